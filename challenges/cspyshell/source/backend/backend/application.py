@@ -1,47 +1,329 @@
+import ast
+import struct
+import threading
 import traceback
+from collections.abc import Buffer, Callable, Iterator
 from dataclasses import dataclass, field
-from typing import Any, NoReturn
+from enum import IntEnum
+from functools import lru_cache
+from time import perf_counter
+from types import CodeType
+from typing import TYPE_CHECKING, Any, NoReturn
 
-from .protocols.typing import SizedProtocolLayer
+from .execution import ExecutionEngine, OutputStream
+from .instrumentation import Instrumented
+from .protocols.channel import ChannelLayer, Multiplexer
+from .protocols.typing import ChannelProtocolLayer, SizedProtocolLayer
+from .streaming import encode_chunks, iter_repr
+
+if TYPE_CHECKING:
+    from .snapshot import Snapshot
+
+
+CODE_CACHE_SIZE = 256
+
+DEFAULT_TIME_BUDGET = 30.0
+
+# time budget of an EXECUTE frame in milliseconds, 0 means the default.
+_EXECUTE_HEADER = struct.Struct(">I")
+
+# channel 0 carries control frames, every other channel is a session.
+CONTROL_CHANNEL = 0
+
+MAX_SESSIONS = 64
+
+# control type and the channel it applies to, followed by a utf-8 reason.
+_CONTROL_HEADER = struct.Struct(">BI")
+
+
+class FrameType(IntEnum):
+    EXECUTE = 0
+    CANCEL = 1
+    PING = 2
+    STDOUT = 16
+    STDERR = 17
+    RESULT = 18
+    PONG = 19
+    RESULT_CHUNK = 20
+
+
+class ControlType(IntEnum):
+    # asks for a session to end and is sent back as the acknowledgement, or is
+    # sent unasked with the traceback when a session fails.
+    CLOSE = 0
+    # sent back for a control frame which could not be handled.
+    ERROR = 1
 
 
 @dataclass
 class Context:
     variables: dict[str, Any] = field(default_factory=dict[str, Any])
+    snapshot: "Snapshot | None" = None
 
 
-class Application:
-    _sock: SizedProtocolLayer
+@lru_cache(maxsize=CODE_CACHE_SIZE)
+def compile_message(message: bytes) -> tuple[CodeType, bool]:
+    tree = compile(message, "<string>", "exec", ast.PyCF_ONLY_AST)
+
+    # a single-line lone expression is evaluated so its value can be echoed.
+    if b"\n" not in message and len(tree.body) == 1:
+        statement = tree.body[0]
+
+        if isinstance(statement, ast.Expr):
+            expression = ast.Expression(statement.value)
+            return compile(expression, "<string>", "eval"), True
+
+    return compile(tree, "<string>", "exec"), False
+
+
+class Application(Instrumented):
+    _sock: SizedProtocolLayer | None
     _context: Context
 
-    def __init__(self, sock: SizedProtocolLayer) -> None:
+    def __init__(
+        self, sock: SizedProtocolLayer | None, context: Context | None = None
+    ) -> None:
         self._sock = sock
-        self._context = Context()
+        self._context = context or Context()
+
+    @property
+    def context(self) -> Context:
+        return self._context
+
+    @property
+    def code_cache_info(self) -> Any:
+        return compile_message.cache_info()
 
-    def handle(self, message: bytes) -> bytes:
-        message = message.strip()
+    def _run_code(self, code: CodeType, is_expression: bool) -> Any:
+        try:
+            if is_expression:
+                return eval(code, self._context.variables, self._context.variables)
+
+            exec(code, self._context.variables, self._context.variables)
+        finally:
+            if self._context.snapshot is not None:
+                self._context.snapshot.discard_shadowed()
+
+    def _evaluate(self, message: bytes) -> tuple[bool, Any]:
+        code, is_expression = compile_message(message)
+
+        if self._stats is None:
+            return is_expression, self._run_code(code, is_expression)
+
+        kind = "eval" if is_expression else "exec"
+        start = perf_counter()
+
+        try:
+            return is_expression, self._run_code(code, is_expression)
+        except Exception:
+            self._stats.add(f"{kind}_errors")
+            raise
+        finally:
+            self._stats.add(f"{kind}s")
+            self._stats.add(f"{kind}_seconds", perf_counter() - start)
+
+    def handle(self, message: Buffer) -> bytes:
+        message = bytes(message).strip()
 
         if not message:
             return b""
 
         try:
-            if b"\n" not in message:
-                try:
-                    val = eval(
-                        message, self._context.variables, self._context.variables
-                    )
-                    return repr(val).encode("utf-8")
-                except SyntaxError:
-                    pass
-
-            exec(message, self._context.variables, self._context.variables)
+            is_expression, val = self._evaluate(message)
+
+            if is_expression:
+                return repr(val).encode("utf-8")
         except Exception:
             return traceback.format_exc().encode("utf-8")
 
         return b""
 
+    def handle_stream(self, message: Buffer) -> Iterator[bytes]:
+        message = bytes(message).strip()
+
+        if not message:
+            return
+
+        try:
+            is_expression, val = self._evaluate(message)
+
+            if is_expression:
+                # the repr is produced piecewise, it never exists in memory whole.
+                yield from encode_chunks(iter_repr(val))
+        except Exception:
+            yield traceback.format_exc().encode("utf-8")
+
+    def close(self) -> None:
+        pass
+
     def run(self) -> NoReturn:
+        assert self._sock is not None, "a socket is needed to run."
+
         while True:
             message = self._sock.recv()
             response = self.handle(message)
             self._sock.send(response)
+
+
+class StreamingApplication(Application):
+    _sock: SizedProtocolLayer
+    _engine: ExecutionEngine
+    _send_lock: threading.Lock
+
+    def __init__(
+        self, sock: SizedProtocolLayer, time_budget: float | None = DEFAULT_TIME_BUDGET
+    ) -> None:
+        super().__init__(sock)
+        self._send_lock = threading.Lock()
+        self._engine = ExecutionEngine(
+            self.handle_stream, self._send_output, self._send_result, time_budget
+        )
+
+    @property
+    def engine(self) -> ExecutionEngine:
+        return self._engine
+
+    def close(self) -> None:
+        self._engine.close()
+
+    def _send_frame(self, frame_type: FrameType, payload: Buffer = b"") -> None:
+        with self._send_lock:
+            self._sock.send(bytes((frame_type,)) + payload)
+
+    def _send_output(self, stream: OutputStream, data: bytes) -> None:
+        match stream:
+            case OutputStream.STDOUT:
+                self._send_frame(FrameType.STDOUT, data)
+            case OutputStream.STDERR:
+                self._send_frame(FrameType.STDERR, data)
+
+    def _send_result(self, result: bytes, final: bool) -> None:
+        self._send_frame(FrameType.RESULT if final else FrameType.RESULT_CHUNK, result)
+
+    def run(self) -> NoReturn:
+        while True:
+            message = memoryview(self._sock.recv())
+            frame_type, payload = FrameType(message[0]), message[1:]
+
+            match frame_type:
+                case FrameType.EXECUTE:
+                    (budget,) = _EXECUTE_HEADER.unpack(payload[: _EXECUTE_HEADER.size])
+                    code = bytes(payload[_EXECUTE_HEADER.size :])
+
+                    self._engine.submit(code, budget / 1000 if budget else None)
+                case FrameType.CANCEL:
+                    self._engine.cancel()
+                case FrameType.PING:
+                    self._send_frame(FrameType.PONG, payload)
+                case _:
+                    raise ValueError(f"unexpected frame type {frame_type.name}.")
+
+
+class SessionManager:
+    _multiplexer: Multiplexer
+    _session_factory: Callable[[SizedProtocolLayer], Application]
+    _max_sessions: int
+    _sessions: dict[int, Application]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        sock: ChannelProtocolLayer,
+        session_factory: Callable[[SizedProtocolLayer], Application] = Application,
+        max_sessions: int = MAX_SESSIONS,
+    ) -> None:
+        self._multiplexer = Multiplexer(sock)
+        self._session_factory = session_factory
+        self._max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sessions(self) -> dict[int, Application]:
+        return self._sessions
+
+    def _send_control(
+        self, control_type: ControlType, channel: int, reason: str = ""
+    ) -> None:
+        header = _CONTROL_HEADER.pack(control_type, channel)
+        self._multiplexer.send(CONTROL_CHANNEL, header + reason.encode("utf-8"))
+
+    def _run_session(self, layer: ChannelLayer, session: Application) -> None:
+        reason = ""
+
+        try:
+            session.run()
+        except EOFError:
+            pass
+        except Exception:
+            # the peer would otherwise keep talking to a session which is gone.
+            reason = traceback.format_exc()
+        finally:
+            session.close()
+
+            # a session closed by the peer has been acknowledged already, and its
+            # channel may have been reopened since.
+            with self._lock:
+                owned = self._sessions.get(layer.channel) is session
+
+                if owned:
+                    del self._sessions[layer.channel]
+
+            self._multiplexer.close(layer)
+
+            if owned:
+                self._send_control(ControlType.CLOSE, layer.channel, reason)
+
+    def _start_session(self, layer: ChannelLayer) -> None:
+        session = self._session_factory(layer)
+
+        # every channel runs its own loop, a slow command only stalls its own.
+        thread = threading.Thread(
+            target=self._run_session,
+            args=(layer, session),
+            name=f"session-{layer.channel}",
+            daemon=True,
+        )
+        thread.start()
+
+        self._sessions[layer.channel] = session
+
+    def _handle_control(self, message: bytes) -> None:
+        # a bad control frame is reported, it must not end the other sessions.
+        if len(message) < _CONTROL_HEADER.size:
+            self._send_control(ControlType.ERROR, CONTROL_CHANNEL, "truncated frame.")
+            return
+
+        control_type, channel = _CONTROL_HEADER.unpack_from(message)
+
+        match control_type:
+            case ControlType.CLOSE if channel != CONTROL_CHANNEL:
+                with self._lock:
+                    self._sessions.pop(channel, None)
+
+                # the session stops on its own, later messages on the channel
+                # start a new session.
+                self._multiplexer.close(self._multiplexer.channel(channel))
+                self._send_control(ControlType.CLOSE, channel)
+            case _:
+                reason = f"unexpected control frame {control_type} for {channel}."
+                self._send_control(ControlType.ERROR, channel, reason)
+
+    def run(self) -> NoReturn:
+        while True:
+            layer = self._multiplexer.dispatch()
+
+            if layer.channel == CONTROL_CHANNEL:
+                self._handle_control(layer.recv())
+                continue
+
+            with self._lock:
+                if layer.channel in self._sessions:
+                    continue
+
+                if len(self._sessions) < self._max_sessions:
+                    self._start_session(layer)
+                    continue
+
+            self._multiplexer.close(layer)
+            self._send_control(ControlType.CLOSE, layer.channel, "too many sessions.")
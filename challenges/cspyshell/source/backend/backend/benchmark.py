@@ -0,0 +1,365 @@
+import json
+import platform
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+import zlib
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import product
+from typing import Any
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .application import Application
+from .protocols.compression import CODECS, Codec, CompressionLayer
+from .protocols.message import MessageLayer
+from .protocols.secure import NonceMode, RecordFraming, SecureLayer
+from .protocols.transport import TransportLayer
+
+PAYLOAD_SIZE = 1 << 20
+ROUNDS = 8
+
+SESSION = [
+    "import hashlib",
+    "table = {i: hashlib.sha256(str(i).encode()).hexdigest() for i in range(64)}",
+    "table",
+    "table[100]",
+    "list(table)[:32]",
+    "undefined_name",
+    "1 / 0",
+    "int('abc')",
+    "def square(x):\n    return x * x",
+    "[square(i) for i in range(100)]",
+    "square('a')",
+    "len(table)",
+]
+SESSION_REPEAT = 3
+
+# 1 B up to 16 MiB in steps of 16x.
+SUITE_SIZES = [1 << shift for shift in range(0, 25, 4)]
+SUITE_PAYLOADS = ["compressible", "random"]
+
+# every case runs for at least this long, but never fewer rounds than this.
+SUITE_MIN_TIME = 0.5
+SUITE_MIN_ROUNDS = 3
+SUITE_MAX_ROUNDS = 1000
+
+
+def secure_pair(
+    framing: RecordFraming | None,
+    nonce_mode: NonceMode | None = None,
+    sockets: tuple[socket.socket, socket.socket] | None = None,
+) -> tuple[SecureLayer, SecureLayer]:
+    left, right = map(TransportLayer, sockets or socket.socketpair())
+
+    with ThreadPoolExecutor(2) as executor:
+        left_future, right_future = (
+            executor.submit(
+                SecureLayer.initiate_connection,
+                transport,
+                X25519PrivateKey.generate(),
+                framing,
+                nonce_mode,
+            )
+            for transport in (left, right)
+        )
+
+        return left_future.result(), right_future.result()
+
+
+def measure_throughput(
+    sender: SecureLayer, receiver: SecureLayer, size: int, rounds: int
+) -> float:
+    payload = bytes(size)
+
+    def send() -> None:
+        for _ in range(rounds):
+            sender.sendall(payload)
+
+    thread = threading.Thread(target=send)
+
+    start = time.perf_counter()
+    thread.start()
+
+    for _ in range(rounds):
+        receiver.recv(size)
+
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    return size * rounds / elapsed
+
+
+def measure_send_throughput(
+    framing: RecordFraming, nonce_mode: NonceMode, size: int, rounds: int
+) -> float:
+    left, right = socket.socketpair()
+    cipher = AESGCM(AESGCM.generate_key(256))
+    sender = SecureLayer(TransportLayer(left), cipher, framing, nonce_mode)
+
+    def drain() -> None:
+        buffer = bytearray(1 << 20)
+        while right.recv_into(buffer):
+            pass
+
+    thread = threading.Thread(target=drain)
+    thread.start()
+
+    payload = bytes(size)
+
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        sender.sendall(payload)
+
+    elapsed = time.perf_counter() - start
+
+    left.close()
+    thread.join()
+    right.close()
+
+    return size * rounds / elapsed
+
+
+def record_transcript() -> list[bytes]:
+    # only handle() is used, which never touches a transport.
+    application = Application(None)
+
+    transcript: list[bytes] = []
+
+    for _ in range(SESSION_REPEAT):
+        for code in SESSION:
+            request = code.encode("utf-8")
+            response = application.handle(request)
+
+            transcript.extend((request, response))
+
+    return transcript
+
+
+def measure_compression(transcript: list[bytes], codec: Codec) -> tuple[float, float]:
+    # requests and responses travel in different directions, one context each.
+    compressors = CODECS[codec](), CODECS[codec]()
+
+    raw_size = compressed_size = 0
+
+    start = time.process_time()
+
+    for i, message in enumerate(transcript):
+        compressed = compressors[i % 2].compress(message)
+
+        raw_size += len(message)
+        compressed_size += len(compressed)
+
+    elapsed = time.process_time() - start
+
+    return compressed_size / raw_size, elapsed
+
+
+def make_payload(kind: str, size: int) -> bytes:
+    if kind == "compressible":
+        text = "\n".join(SESSION).encode("utf-8")
+        return (text * (size // len(text) + 1))[:size]
+
+    return random.randbytes(size)
+
+
+def stack_pair(
+    negotiated: bool,
+) -> tuple[CompressionLayer, CompressionLayer, tuple[socket.socket, socket.socket]]:
+    sockets = socket.socketpair()
+
+    if not negotiated:
+        # exactly what the frontend speaks.
+        left, right = secure_pair(None, sockets=sockets)
+        return (
+            CompressionLayer(MessageLayer(left), zlib),
+            CompressionLayer(MessageLayer(right), zlib),
+            sockets,
+        )
+
+    left, right = secure_pair(RecordFraming.LONG, NonceMode.COUNTER, sockets)
+
+    with ThreadPoolExecutor(2) as executor:
+        client_future, server_future = (
+            executor.submit(
+                CompressionLayer.initiate_connection,
+                MessageLayer(secure),
+                [Codec.ZLIB_STREAM],
+            )
+            for secure in (left, right)
+        )
+
+        return client_future.result(), server_future.result(), sockets
+
+
+def _serve(server: Callable[[CompressionLayer], object], layer: CompressionLayer) -> None:
+    try:
+        server(layer)
+    except (EOFError, OSError):
+        pass
+
+
+def _echo(layer: CompressionLayer) -> None:
+    while True:
+        layer.send(layer.recv())
+
+
+@contextmanager
+def loopback(
+    negotiated: bool, server: Callable[[CompressionLayer], object]
+) -> Iterator[CompressionLayer]:
+    client, server_layer, (client_socket, server_socket) = stack_pair(negotiated)
+
+    thread = threading.Thread(target=_serve, args=(server, server_layer))
+    thread.start()
+
+    try:
+        yield client
+    finally:
+        # the server loop ends on EOF.
+        client_socket.close()
+        thread.join()
+        server_socket.close()
+
+
+def measure_round_trips(round_trip: Callable[[], object]) -> list[float]:
+    timings: list[float] = []
+    total = 0.0
+
+    while len(timings) < SUITE_MIN_ROUNDS or (
+        total < SUITE_MIN_TIME and len(timings) < SUITE_MAX_ROUNDS
+    ):
+        start = time.perf_counter()
+        round_trip()
+        elapsed = time.perf_counter() - start
+
+        timings.append(elapsed)
+        total += elapsed
+
+    return timings
+
+
+def summarize(timings: list[float], size: int) -> dict[str, Any]:
+    median = statistics.median(timings)
+
+    return {
+        "rounds": len(timings),
+        "latency_min": min(timings),
+        "latency_median": median,
+        "latency_mean": statistics.fmean(timings),
+        # payload bytes per second of round trip, i.e. one direction.
+        "throughput": size / median,
+    }
+
+
+def run_echo(negotiated: bool, kind: str, size: int) -> dict[str, Any]:
+    payload = make_payload(kind, size)
+
+    with loopback(negotiated, _echo) as client:
+
+        def round_trip() -> None:
+            client.send(payload)
+            client.recv()
+
+        return summarize(measure_round_trips(round_trip), size)
+
+
+def run_application(negotiated: bool, kind: str, size: int) -> dict[str, Any]:
+    if kind == "compressible":
+        setup = f"payload = ('abcdefgh' * {size // 8 + 1})[:{size}]"
+    else:
+        setup = (
+            "import base64, random\n"
+            f"payload = base64.b64encode(random.randbytes({size})).decode()[:{size}]"
+        )
+
+    with loopback(negotiated, lambda layer: Application(layer).run()) as client:
+        client.send(setup.encode("utf-8"))
+        client.recv()
+
+        def round_trip() -> None:
+            client.send(b"payload")
+            client.recv()
+
+        return summarize(measure_round_trips(round_trip), size)
+
+
+def run_suite(sizes: list[int] = SUITE_SIZES) -> list[dict[str, Any]]:
+    cases = {"echo": run_echo, "application": run_application}
+    results: list[dict[str, Any]] = []
+
+    for (name, run), negotiated, kind, size in product(
+        cases.items(), (False, True), SUITE_PAYLOADS, sizes
+    ):
+        stack = "negotiated" if negotiated else "legacy"
+        result = {"case": name, "stack": stack, "payload": kind, "size": size}
+        result.update(run(negotiated, kind, size))
+
+        print(
+            f"{name:<12} {stack:<10} {kind:<12} {size:>9} B "
+            f"{result['latency_median'] * 1000:>10.3f} ms "
+            f"{result['throughput'] / (1 << 20):>10.2f} MiB/s"
+        )
+
+        results.append(result)
+
+    return results
+
+
+def main() -> None:
+    report: dict[str, Any] = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "time": time.time(),
+    }
+
+    pairs = [(None, None), *product(RecordFraming, NonceMode)]
+
+    report["secure"] = {}
+    for framing, nonce_mode in pairs:
+        sockets = socket.socketpair()
+
+        with sockets[0], sockets[1]:
+            sender, receiver = secure_pair(framing, nonce_mode, sockets)
+            throughput = measure_throughput(sender, receiver, PAYLOAD_SIZE, ROUNDS)
+
+        name = "legacy"
+        if framing is not None and nonce_mode is not None:
+            name = f"{framing.name} {nonce_mode.name}"
+
+        report["secure"][name] = throughput
+        print(f"{name:<16} {throughput / (1 << 20):>10.2f} MiB/s")
+
+    report["secure_send"] = {}
+    for framing, nonce_mode in product(RecordFraming, NonceMode):
+        throughput = measure_send_throughput(framing, nonce_mode, PAYLOAD_SIZE, ROUNDS)
+        name = f"{framing.name} {nonce_mode.name}"
+
+        report["secure_send"][name] = throughput
+        print(f"{name:<16} {throughput / (1 << 20):>10.2f} MiB/s (send only)")
+
+    transcript = record_transcript()
+
+    report["compression"] = {}
+    for codec in Codec:
+        ratio, elapsed = measure_compression(transcript, codec)
+
+        report["compression"][codec.name] = {"ratio": ratio, "cpu_time": elapsed}
+        print(f"{codec.name:<16} {ratio:>10.3f} ratio {elapsed * 1000:>8.2f} ms cpu")
+
+    report["suite"] = run_suite()
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import contextlib
+import ctypes
+import queue
+import sys
+import threading
+import traceback
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from enum import IntEnum
+from functools import partial
+from typing import Any, TextIO
+
+OUTPUT_FLUSH_SIZE = 1 << 14
+OUTPUT_FLUSH_INTERVAL = 0.05
+
+# frames waiting for the sender thread, the worker blocks once this is full.
+OUTBOX_SIZE = 4
+
+# an expired job which swallowed its interrupt is interrupted again this often.
+INTERRUPT_REPEAT_INTERVAL = 1.0
+
+
+# not an Exception, so that `except Exception` in user code lets it through.
+class TimeBudgetExceeded(BaseException):
+    pass
+
+
+class OutputStream(IntEnum):
+    STDOUT = 0
+    STDERR = 1
+
+
+@dataclass(eq=False)
+class Job:
+    code: bytes
+    time_budget: float | None
+    interrupted: bool = False
+
+
+class _OutputSink:
+    _stream: OutputStream
+    _callback: Callable[[OutputStream, bytes], None]
+    _lock: threading.Lock
+    _parts: list[str]
+    _size: int
+    _timer: threading.Timer | None
+
+    def __init__(
+        self, stream: OutputStream, callback: Callable[[OutputStream, bytes], None]
+    ) -> None:
+        self._stream = stream
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._parts = []
+        self._size = 0
+        self._timer = None
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            self._parts.append(text)
+            self._size += len(text)
+
+            if self._size < OUTPUT_FLUSH_SIZE:
+                # small writes are coalesced, but never held back for long.
+                if self._timer is None:
+                    self._timer = threading.Timer(OUTPUT_FLUSH_INTERVAL, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+                return len(text)
+
+        self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._parts:
+                return
+
+            data = "".join(self._parts).encode("utf-8", "backslashreplace")
+
+            self._parts.clear()
+            self._size = 0
+
+            # sent under the lock so that chunks of one stream stay in order.
+            self._callback(self._stream, data)
+
+
+_sinks = threading.local()
+
+
+class _RedirectedStream:
+    _name: str
+    _original: TextIO
+
+    def __init__(self, name: str, original: TextIO) -> None:
+        self._name = name
+        self._original = original
+
+    def _target(self) -> _OutputSink | TextIO:
+        return getattr(_sinks, self._name, None) or self._original
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._original, name)
+
+
+_redirect_lock = threading.Lock()
+
+
+def _install_redirects() -> None:
+    with _redirect_lock:
+        if not isinstance(sys.stdout, _RedirectedStream):
+            sys.stdout = _RedirectedStream("stdout", sys.stdout)
+
+        if not isinstance(sys.stderr, _RedirectedStream):
+            sys.stderr = _RedirectedStream("stderr", sys.stderr)
+
+
+def _async_raise(thread_id: int, exc_type: type[BaseException] | None) -> None:
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        ctypes.py_object(exc_type) if exc_type is not None else None,
+    )
+
+
+class ExecutionEngine:
+    _handler: Callable[[bytes], Iterable[bytes]]
+    _on_output: Callable[[OutputStream, bytes], None]
+    _on_result: Callable[[bytes, bool], None]
+    _time_budget: float | None
+    _jobs: queue.SimpleQueue[Job | None]
+    _outbox: queue.Queue[Callable[[], None] | None]
+    _lock: threading.Lock
+    _current: Job | None
+    _stopped: threading.Event
+    _error: Exception | None
+    _thread: threading.Thread
+    _sender: threading.Thread
+
+    def __init__(
+        self,
+        handler: Callable[[bytes], Iterable[bytes]],
+        on_output: Callable[[OutputStream, bytes], None],
+        on_result: Callable[[bytes, bool], None],
+        time_budget: float | None = None,
+    ) -> None:
+        self._handler = handler
+        self._on_output = on_output
+        self._on_result = on_result
+        self._time_budget = time_budget
+        self._jobs = queue.SimpleQueue()
+        self._outbox = queue.Queue(OUTBOX_SIZE)
+        self._lock = threading.Lock()
+        self._current = None
+        self._stopped = threading.Event()
+        self._error = None
+
+        _install_redirects()
+
+        self._thread = threading.Thread(target=self._run, name="execution", daemon=True)
+        self._thread.start()
+
+        self._sender = threading.Thread(target=self._deliver, name="sender", daemon=True)
+        self._sender.start()
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None
+
+    @property
+    def error(self) -> Exception | None:
+        return self._error
+
+    def submit(self, code: bytes, time_budget: float | None = None) -> Job:
+        if self._error is not None:
+            raise RuntimeError("results can no longer be sent.") from self._error
+
+        if self._stopped.is_set():
+            raise RuntimeError("engine is closed.")
+
+        job = Job(code, time_budget if time_budget is not None else self._time_budget)
+        self._jobs.put(job)
+        return job
+
+    def _interrupt(self, job: Job, exc_type: type[BaseException]) -> bool:
+        with self._lock:
+            # a pending exception never outlives its job, it is cleared in _finish.
+            if self._current is not job:
+                return False
+
+            job.interrupted = True
+
+            assert self._thread.ident is not None
+            _async_raise(self._thread.ident, exc_type)
+
+            return True
+
+    def cancel(self) -> bool:
+        job = self._current
+        return job is not None and self._interrupt(job, KeyboardInterrupt)
+
+    def _expire(self, job: Job) -> None:
+        if self._interrupt(job, TimeBudgetExceeded):
+            timer = threading.Timer(INTERRUPT_REPEAT_INTERVAL, self._expire, (job,))
+            timer.daemon = True
+            timer.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.cancel()
+
+        self._jobs.put(None)
+
+        # nothing is sent any more, so pending frames are dropped to make room
+        # for the sender's stop marker without ever blocking here.
+        while True:
+            try:
+                self._outbox.get_nowait()
+            except queue.Empty:
+                break
+
+        with contextlib.suppress(queue.Full):
+            self._outbox.put_nowait(None)
+
+    def _finish(self) -> None:
+        with self._lock:
+            self._current = None
+
+            assert self._thread.ident is not None
+            _async_raise(self._thread.ident, None)
+
+    def _post(self, send: Callable[[], None]) -> None:
+        # the socket is only ever written by the sender thread, so an interrupt
+        # raised in the worker can never tear a frame apart.
+        if not self._stopped.is_set():
+            self._outbox.put(send)
+
+    def _post_output(self, stream: OutputStream, data: bytes) -> None:
+        self._post(partial(self._on_output, stream, data))
+
+    def _execute(self, job: Job) -> None:
+        stdout = _OutputSink(OutputStream.STDOUT, self._post_output)
+        stderr = _OutputSink(OutputStream.STDERR, self._post_output)
+
+        timer = None
+        if job.time_budget is not None:
+            timer = threading.Timer(job.time_budget, self._expire, (job,))
+            timer.daemon = True
+
+        with self._lock:
+            self._current = job
+
+        _sinks.stdout, _sinks.stderr = stdout, stderr
+
+        # one chunk is held back, so that the last one can be marked as final.
+        pending = b""
+
+        try:
+            try:
+                if timer is not None:
+                    timer.start()
+
+                for chunk in self._handler(job.code):
+                    previous, pending = pending, chunk
+
+                    if previous:
+                        self._post(partial(self._on_result, previous, False))
+            finally:
+                self._finish()
+        except BaseException:
+            # interrupts raised outside of the handler's own error handling.
+            self._finish()
+
+            if pending:
+                self._post(partial(self._on_result, pending, False))
+
+            pending = traceback.format_exc().encode("utf-8")
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            _sinks.stdout = _sinks.stderr = None
+
+            stdout.flush()
+            stderr.flush()
+
+        self._post(partial(self._on_result, pending, True))
+
+    def _run(self) -> None:
+        while (job := self._jobs.get()) is not None:
+            self._execute(job)
+
+    def _deliver(self) -> None:
+        while (send := self._outbox.get()) is not None:
+            # the outbox keeps being drained, so the worker never blocks on it.
+            if self._stopped.is_set():
+                continue
+
+            try:
+                send()
+            except Exception as e:
+                self._error = e
+                self._stopped.set()
+
+                # whatever the job still produces can not be delivered.
+                self.cancel()
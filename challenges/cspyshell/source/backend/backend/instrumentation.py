@@ -0,0 +1,85 @@
+import json
+import threading
+from collections import defaultdict
+from typing import Any
+
+
+class Stats:
+    _lock: threading.Lock
+    _counters: defaultdict[str, float]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def __getitem__(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0.0)
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class Instrumented:
+    # layers only pay for a None check on their hot paths while this is unset.
+    _stats: Stats | None = None
+
+    @property
+    def stats(self) -> Stats | None:
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats: Stats | None) -> None:
+        self._stats = stats
+
+
+def _ratio(numerator: float, denominator: float) -> float | None:
+    return numerator / denominator if denominator else None
+
+
+class Instrumentation:
+    _layers: dict[str, Stats]
+
+    def __init__(self) -> None:
+        self._layers = {}
+
+    def stats(self, name: str) -> Stats:
+        return self._layers.setdefault(name, Stats())
+
+    def attach(self, name: str, layer: Instrumented) -> None:
+        layer.stats = self.stats(name)
+
+    def _derived(self) -> dict[str, float | None]:
+        secure = self._layers.get("secure", Stats())
+        message = self._layers.get("message", Stats())
+        compression = self._layers.get("compression", Stats())
+
+        return {
+            "records_per_message_in": _ratio(secure["records_in"], message["messages_in"]),
+            "records_per_message_out": _ratio(
+                secure["records_out"], message["messages_out"]
+            ),
+            "compression_ratio_in": _ratio(
+                compression["bytes_in"], compression["raw_bytes_in"]
+            ),
+            "compression_ratio_out": _ratio(
+                compression["bytes_out"], compression["raw_bytes_out"]
+            ),
+        }
+
+    def snapshot(self) -> dict[str, Any]:
+        snapshot: dict[str, Any] = {
+            name: stats.snapshot() for name, stats in self._layers.items()
+        }
+        snapshot["derived"] = self._derived()
+
+        return snapshot
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as fp:
+            json.dump(self.snapshot(), fp, indent=2)
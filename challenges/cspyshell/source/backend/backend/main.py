@@ -1,18 +1,21 @@
+import os
 import socket
 import sys
-import zlib
+from collections.abc import Callable
+from functools import cache
 from random import Random
-from typing import Any
+from typing import TYPE_CHECKING, Any, NoReturn
 
-from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from . import pool
+from .profiling import ImportProfiler
 
-from .application import Application
-from .protocols.compression import CompressionLayer
-from .protocols.message import MessageLayer
-from .protocols.secure import SecureLayer
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
 
 
-def generate_static_private_key(seed: Any) -> X25519PrivateKey:
+def generate_static_private_key(seed: Any) -> "X25519PrivateKey":
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
     key_bytes = Random(seed).randbytes(32)
     key = X25519PrivateKey.from_private_bytes(key_bytes)
     return key
@@ -21,17 +24,126 @@ def generate_static_private_key(seed: Any) -> X25519PrivateKey:
 PRIVATE_KEY_SEED = bytes([
     0x0D, 0x00, 0x07, 0x21, 0x01, 0xBF, 0x52, 0x1D, 0x4B, 0x42, 0x11, 0x45, 0x14, 0x57, 0xA7, 0x00,
 ])
-PRIVATE_KEY = generate_static_private_key(PRIVATE_KEY_SEED)
 
 
-def main() -> None:
+@cache
+def get_private_key() -> "X25519PrivateKey":
+    return generate_static_private_key(PRIVATE_KEY_SEED)
+
+
+def __getattr__(name: str) -> Any:
+    # derived on first access rather than when the module is imported.
+    if name == "PRIVATE_KEY":
+        return get_private_key()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# when set, per-layer stats are collected and written there as JSON on close.
+STATS_PATH_ENV = "BACKEND_STATS"
+
+# when set, the time spent importing each module is written there.
+IMPORT_PROFILE_ENV = "BACKEND_IMPORT_PROFILE"
+
+# when set, the session is restored from there and saved back on close.
+SNAPSHOT_PATH_ENV = "BACKEND_SNAPSHOT"
+
+
+def warm_up() -> None:
+    # everything serve() needs, a frozen build cannot import once cleaned up.
+    import zlib  # noqa: F401
+
+    from . import application, instrumentation, snapshot  # noqa: F401
+    from .protocols import compression, message, secure, transport  # noqa: F401
+
+    get_private_key()
+
+
+def serve(tcp_layer: socket.socket) -> NoReturn:
+    from .application import Application, Context
+    from .instrumentation import Instrumentation
+    from .protocols.compression import CompressionLayer
+    from .protocols.message import MessageLayer
+    from .protocols.secure import SecureLayer
+    from .protocols.transport import TransportLayer
+    from .snapshot import Snapshot, save_snapshot
+
+    import zlib
+
+    transport_layer = TransportLayer(tcp_layer)
+    secure_layer = SecureLayer.initiate_connection(transport_layer, get_private_key())
+    message_layer = MessageLayer(secure_layer)
+    compression_layer = CompressionLayer(message_layer, zlib)
+
+    context = Context()
+
+    snapshot_path = os.environ.get(SNAPSHOT_PATH_ENV)
+    snapshot = None
+
+    if snapshot_path and os.path.exists(snapshot_path):
+        snapshot = Snapshot.open(snapshot_path)
+        snapshot.attach(context.variables)
+        context.snapshot = snapshot
+
+    app = Application(compression_layer, context)
+
+    stats_path = os.environ.get(STATS_PATH_ENV)
+    instrumentation = Instrumentation() if stats_path else None
+
+    if instrumentation is not None:
+        instrumentation.attach("transport", transport_layer)
+        instrumentation.attach("secure", secure_layer)
+        instrumentation.attach("message", message_layer)
+        instrumentation.attach("compression", compression_layer)
+        instrumentation.attach("application", app)
+
+    try:
+        app.run()
+    finally:
+        if instrumentation is not None:
+            instrumentation.dump(stats_path)
+
+        if snapshot_path:
+            save_snapshot(context.variables, snapshot_path, snapshot)
+
+
+def _prepare(cleanup: Callable[[], None] | None) -> None:
+    warm_up()
+
+    if cleanup is not None:
+        cleanup()
+
+
+def main(cleanup: Callable[[], None] | None = None) -> None:
+    # cleanup runs once the whole stack is imported, so it may delete the files
+    # it was imported from.
+    if sys.argv[1] == "pool":
+        size = int(sys.argv[3]) if len(sys.argv) > 3 else pool.DEFAULT_POOL_SIZE
+        pool.serve_pool(sys.argv[2], size, lambda: _prepare(cleanup), serve)
+
     address = sys.argv[1], int(sys.argv[2])
     tcp_layer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp_layer.connect(address)
 
-    secure_layer = SecureLayer.initiate_connection(tcp_layer, PRIVATE_KEY)
-    message_layer = MessageLayer(secure_layer)
-    compression_layer = CompressionLayer(message_layer, zlib)
+    pool_path = os.environ.get(pool.POOL_PATH_ENV)
+    if pool_path and pool.hand_off(pool_path, tcp_layer):
+        if cleanup is not None:
+            cleanup()
+
+        return
+
+    profile_path = os.environ.get(IMPORT_PROFILE_ENV)
+    profiler = ImportProfiler.install() if profile_path else None
+
+    # connected first, so the frontend prepares its side of the handshake
+    # while the stack is being imported here.
+    warm_up()
+
+    if profiler is not None:
+        profiler.uninstall()
+        profiler.dump(profile_path)
+
+    if cleanup is not None:
+        cleanup()
 
-    app = Application(compression_layer)
-    app.run()
+    serve(tcp_layer)
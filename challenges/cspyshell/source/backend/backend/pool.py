@@ -0,0 +1,131 @@
+import contextlib
+import os
+import signal
+import socket
+import struct
+import sys
+from collections.abc import Callable
+from types import FrameType
+from typing import NoReturn
+
+DEFAULT_POOL_SIZE = 4
+
+# launched backends hand their connection to the pool listening here if set.
+POOL_PATH_ENV = "BACKEND_POOL"
+
+
+def hand_off(path: str, connection: socket.socket) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as pool_socket:
+            pool_socket.connect(path)
+            socket.send_fds(pool_socket, [b"\x00"], [connection.fileno()])
+
+            # the worker acknowledges once it owns its copy of the descriptor.
+            return pool_socket.recv(1) == b"\x00"
+    except OSError:
+        return False
+
+
+# each worker reports its pid once it took a connection.
+_READY = struct.Struct("=i")
+
+# reported in place of a pid when a worker exited.
+_EXITED = 0
+
+
+def _work(
+    listener: socket.socket, ready: int, serve: Callable[[socket.socket], NoReturn]
+) -> NoReturn:
+    client, _ = listener.accept()
+
+    # let the parent fork a replacement while this one is busy.
+    os.write(ready, _READY.pack(os.getpid()))
+    os.close(ready)
+    listener.close()
+
+    with client:
+        _, fds, _, _ = socket.recv_fds(client, 1, 1)
+        client.sendall(b"\x00")
+
+    serve(socket.socket(fileno=fds[0]))
+
+
+def _spawn(
+    listener: socket.socket, ready: int, serve: Callable[[socket.socket], NoReturn]
+) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+
+    try:
+        # sessions may run subprocesses, which need to wait for their children.
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _work(listener, ready, serve)
+    finally:
+        # never fall back into the parent's loop.
+        os._exit(0)
+
+
+def _terminate(signum: int, frame: FrameType | None) -> NoReturn:
+    sys.exit(0)
+
+
+def _reap() -> set[int]:
+    exited = set()
+
+    with contextlib.suppress(ChildProcessError):
+        while (pid := os.waitpid(-1, os.WNOHANG)[0]) != 0:
+            exited.add(pid)
+
+    return exited
+
+
+def serve_pool(
+    path: str,
+    size: int,
+    warm_up: Callable[[], None],
+    serve: Callable[[socket.socket], NoReturn],
+) -> NoReturn:
+    # everything imported here is shared copy-on-write with every worker.
+    warm_up()
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    ready_r, ready_w = os.pipe()
+
+    # exits are reported through the same pipe, so that the loop reaps them.
+    signal.signal(
+        signal.SIGCHLD, lambda signum, frame: os.write(ready_w, _READY.pack(_EXITED))
+    )
+
+    idle = {_spawn(listener, ready_w, serve) for _ in range(size)}
+
+    try:
+        while True:
+            for (pid,) in _READY.iter_unpack(os.read(ready_r, _READY.size * size)):
+                if pid != _EXITED:
+                    idle.discard(pid)
+                    idle.add(_spawn(listener, ready_w, serve))
+                    continue
+
+                # an idle worker that died would leave the pool short otherwise.
+                for dead in idle & _reap():
+                    idle.discard(dead)
+                    idle.add(_spawn(listener, ready_w, serve))
+    finally:
+        try:
+            # busy workers keep serving their sessions, only idle ones are stopped.
+            for pid in idle:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGTERM)
+        finally:
+            listener.close()
+            os.unlink(path)
@@ -0,0 +1,98 @@
+import sys
+from collections.abc import Callable, Sequence
+from importlib.machinery import ModuleSpec
+from time import perf_counter
+from types import ModuleType
+from typing import Any, Self
+
+
+class _TimedLoader:
+    _profiler: "ImportProfiler"
+    _loader: Any
+
+    def __init__(self, profiler: "ImportProfiler", loader: Any) -> None:
+        self._profiler = profiler
+        self._loader = loader
+
+    def create_module(self, spec: ModuleSpec) -> ModuleType | None:
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType) -> None:
+        self._profiler.measure(module.__name__, self._loader.exec_module, module)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._loader, name)
+
+
+class ImportProfiler:
+    _entries: list[tuple[int, str, float, float]]
+    _children: list[float]
+
+    def __init__(self) -> None:
+        self._entries = []
+        self._children = []
+
+    @property
+    def entries(self) -> list[tuple[int, str, float, float]]:
+        return self._entries
+
+    @classmethod
+    def install(cls) -> Self:
+        profiler = cls()
+        sys.meta_path.insert(0, profiler)
+        return profiler
+
+    def uninstall(self) -> None:
+        sys.meta_path.remove(self)
+
+    def find_spec(
+        self,
+        fullname: str,
+        path: Sequence[str] | None,
+        target: ModuleType | None = None,
+    ) -> ModuleSpec | None:
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+
+            spec = finder.find_spec(fullname, path, target)
+
+            if spec is None:
+                continue
+
+            if hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(self, spec.loader)
+
+            return spec
+
+        return None
+
+    def measure(
+        self, name: str, exec_module: Callable[[ModuleType], None], module: ModuleType
+    ) -> None:
+        self._children.append(0.0)
+        start = perf_counter()
+
+        try:
+            exec_module(module)
+        finally:
+            cumulative = perf_counter() - start
+            children = self._children.pop()
+
+            if self._children:
+                self._children[-1] += cumulative
+
+            self._entries.append(
+                (len(self._children), name, cumulative - children, cumulative)
+            )
+
+    def dump(self, path: str) -> None:
+        # the same layout as `python -X importtime`, so existing tools can read it.
+        with open(path, "w") as fp:
+            fp.write("import time: self [us] | cumulative | imported package\n")
+
+            for depth, name, own, cumulative in self._entries:
+                fp.write(
+                    f"import time: {own * 1e6:>9.0f} | {cumulative * 1e6:>10.0f} | "
+                    f"{'  ' * depth}{name}\n"
+                )
@@ -0,0 +1,79 @@
+import asyncio
+from collections.abc import Buffer
+
+from ..instrumentation import Instrumented
+from .message import encode_varint
+from .typing import AsyncBufferedProtocolLayer
+
+
+class AsyncMessageLayer(Instrumented):
+    _underlying: AsyncBufferedProtocolLayer
+    _recv_lock: asyncio.Lock
+
+    def __init__(self, underlying: AsyncBufferedProtocolLayer) -> None:
+        self._underlying = underlying
+        self._recv_lock = asyncio.Lock()
+
+    @property
+    def underlying(self) -> AsyncBufferedProtocolLayer:
+        return self._underlying
+
+    async def _recv_varint(self) -> int:
+        num = 0
+        size = 0
+
+        while True:
+            size += 1
+            byte = (await self._underlying.peek(size))[-1]
+
+            num |= (byte & 127) << ((size - 1) * 7)
+            if byte < 128:
+                break
+
+        self._underlying.consume(size)
+
+        return num
+
+    def _count(self, direction: str, size: int) -> None:
+        assert self._stats is not None
+
+        self._stats.add(f"messages_{direction}")
+        self._stats.add(f"bytes_{direction}", size)
+
+    async def recv(self) -> bytes:
+        async with self._recv_lock:
+            size = await self._recv_varint()
+
+            if self._stats is not None:
+                self._count("in", size)
+
+            return await self._underlying.recv(size)
+
+    async def recv_channel(self) -> tuple[int, bytes]:
+        async with self._recv_lock:
+            channel = await self._recv_varint()
+            size = await self._recv_varint()
+
+            if self._stats is not None:
+                self._count("in", size)
+
+            return channel, await self._underlying.recv(size)
+
+    async def send(self, data: Buffer) -> None:
+        data = memoryview(data)
+        size = len(data)
+
+        if self._stats is not None:
+            self._count("out", size)
+
+        await self._underlying.sendall_vectored((encode_varint(size), data))
+
+    async def send_channel(self, channel: int, data: Buffer) -> None:
+        data = memoryview(data)
+        size = len(data)
+
+        if self._stats is not None:
+            self._count("out", size)
+
+        header = encode_varint(channel) + encode_varint(size)
+        await self._underlying.sendall_vectored((header, data))
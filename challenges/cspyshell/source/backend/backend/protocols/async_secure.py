@@ -0,0 +1,105 @@
+import asyncio
+from collections.abc import Buffer, Sequence
+from concurrent.futures import Executor
+from typing import Self
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .secure import NonceMode, RecordFraming, _SecureLayerBase
+from .typing import AsyncBufferedProtocolLayer
+
+
+class AsyncSecureLayer(_SecureLayerBase):
+    _underlying: AsyncBufferedProtocolLayer
+    _recv_lock: asyncio.Lock
+    _send_lock: asyncio.Lock
+
+    def __init__(
+        self,
+        underlying: AsyncBufferedProtocolLayer,
+        cipher: AESGCM,
+        framing: RecordFraming = RecordFraming.BYTE,
+        nonce_mode: NonceMode = NonceMode.RANDOM,
+        direction: int = 0,
+        executor: Executor | None = None,
+    ) -> None:
+        super().__init__(cipher, framing, nonce_mode, direction, executor)
+        self._underlying = underlying
+        self._recv_lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+
+    @property
+    def underlying(self) -> AsyncBufferedProtocolLayer:
+        return self._underlying
+
+    @classmethod
+    async def initiate_connection(
+        cls,
+        underlying: AsyncBufferedProtocolLayer,
+        key: X25519PrivateKey,
+        framing: RecordFraming | None = None,
+        nonce_mode: NonceMode | None = None,
+        executor: Executor | None = None,
+    ) -> Self:
+        my_public_key = key.public_key()
+        my_public_key_bytes = my_public_key.public_bytes_raw()
+        await underlying.sendall(my_public_key_bytes)
+
+        other_public_key_bytes = await underlying.recv(32)
+        cipher = cls._derive_cipher(key, other_public_key_bytes)
+
+        if framing is None and nonce_mode is None:
+            return cls(underlying, cipher, executor=executor)
+
+        framing = framing or RecordFraming.BYTE
+        nonce_mode = nonce_mode or NonceMode.RANDOM
+
+        await underlying.sendall(bytes((framing, nonce_mode)))
+        other_options = await underlying.recv(2)
+        framing, nonce_mode = cls._agree(framing, nonce_mode, other_options)
+
+        direction = cls._get_direction(my_public_key_bytes, other_public_key_bytes)
+
+        return cls(underlying, cipher, framing, nonce_mode, direction, executor)
+
+    async def _recv_blocks(self) -> None:
+        header = await self._underlying.peek(self._framing.header.size)
+        await self._underlying.peek(self._record_size(header))
+
+        buffered = await self._underlying.peek(self._underlying.buffered)
+        records = self._complete_records(buffered)
+
+        if self._executor is None:
+            size = self._open_records(records)
+        else:
+            size = await asyncio.to_thread(self._open_records, records)
+
+        self._underlying.consume(size)
+
+    async def peek(self, size: int) -> memoryview:
+        async with self._recv_lock:
+            while self._available < size:
+                await self._recv_blocks()
+
+            return self._peek_buffered(size)
+
+    async def recv(self, bufsize: int) -> bytes:
+        async with self._recv_lock:
+            while self._available < bufsize:
+                await self._recv_blocks()
+
+            return self._take_buffered(bufsize)
+
+    async def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None:
+        async with self._send_lock:
+            for batch in self._batches(buffers):
+                if self._executor is None:
+                    records = self._seal_records(batch)
+                else:
+                    records = await asyncio.to_thread(self._seal_records, batch)
+
+                await self._underlying.sendall_vectored(records)
+
+    async def sendall(self, data: Buffer) -> None:
+        await self.sendall_vectored((data,))
@@ -0,0 +1,69 @@
+import asyncio
+from collections.abc import Buffer, Sequence
+
+from .transport import DEFAULT_BUFFER_SIZE, _TransportLayerBase
+
+
+class AsyncTransportLayer(_TransportLayerBase):
+    _reader: asyncio.StreamReader
+    _writer: asyncio.StreamWriter
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        bufsize: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        super().__init__(bufsize)
+        self._reader = reader
+        self._writer = writer
+
+    @property
+    def reader(self) -> asyncio.StreamReader:
+        return self._reader
+
+    @property
+    def writer(self) -> asyncio.StreamWriter:
+        return self._writer
+
+    async def _fill(self, size: int) -> None:
+        while self._end - self._start < size:
+            if len(self._buffer) - self._start < size:
+                self._compact(size)
+
+            data = await self._reader.read(len(self._buffer) - self._end)
+
+            if not data:
+                raise EOFError("connection closed by peer.")
+
+            self._buffer[self._end : self._end + len(data)] = data
+            self._end += len(data)
+
+            if self._stats is not None:
+                self._stats.add("reads")
+                self._stats.add("bytes_in", len(data))
+
+    async def peek(self, size: int) -> memoryview:
+        await self._fill(size)
+        return memoryview(self._buffer)[self._start : self._start + size]
+
+    async def recv(self, bufsize: int) -> bytes:
+        data = bytes(await self.peek(bufsize))
+        self.consume(bufsize)
+        return data
+
+    async def sendall(self, data: Buffer) -> None:
+        self._writer.write(data)
+        await self._writer.drain()
+
+        if self._stats is not None:
+            self._stats.add("writes")
+            self._stats.add("bytes_out", memoryview(data).nbytes)
+
+    async def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None:
+        self._writer.writelines(buffers)
+        await self._writer.drain()
+
+        if self._stats is not None:
+            self._stats.add("writes")
+            self._stats.add("bytes_out", sum(memoryview(b).nbytes for b in buffers))
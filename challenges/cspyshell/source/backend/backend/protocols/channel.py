@@ -0,0 +1,83 @@
+import queue
+import threading
+from collections.abc import Buffer
+
+from .typing import ChannelProtocolLayer
+
+
+class ChannelLayer:
+    _multiplexer: "Multiplexer"
+    _channel: int
+    _queue: queue.SimpleQueue[bytes | None]
+
+    def __init__(self, multiplexer: "Multiplexer", channel: int) -> None:
+        self._multiplexer = multiplexer
+        self._channel = channel
+        self._queue = queue.SimpleQueue()
+
+    @property
+    def multiplexer(self) -> "Multiplexer":
+        return self._multiplexer
+
+    @property
+    def channel(self) -> int:
+        return self._channel
+
+    def feed(self, data: bytes) -> None:
+        self._queue.put(data)
+
+    def close(self) -> None:
+        # a pending recv wakes up and fails like a closed connection would.
+        self._queue.put(None)
+
+    def recv(self) -> bytes:
+        data = self._queue.get()
+
+        if data is None:
+            self._queue.put(None)
+            raise EOFError("channel closed.")
+
+        return data
+
+    def send(self, data: Buffer) -> None:
+        self._multiplexer.send(self._channel, data)
+
+
+class Multiplexer:
+    _underlying: ChannelProtocolLayer
+    _channels: dict[int, ChannelLayer]
+    _send_lock: threading.Lock
+
+    def __init__(self, underlying: ChannelProtocolLayer) -> None:
+        self._underlying = underlying
+        self._channels = {}
+        self._send_lock = threading.Lock()
+
+    @property
+    def underlying(self) -> ChannelProtocolLayer:
+        return self._underlying
+
+    def channel(self, channel: int) -> ChannelLayer:
+        if channel not in self._channels:
+            self._channels[channel] = ChannelLayer(self, channel)
+
+        return self._channels[channel]
+
+    def close(self, layer: ChannelLayer) -> None:
+        # the channel may already have been reopened with a new layer.
+        if self._channels.get(layer.channel) is layer:
+            del self._channels[layer.channel]
+
+        layer.close()
+
+    def dispatch(self) -> ChannelLayer:
+        channel, data = self._underlying.recv_channel()
+
+        layer = self.channel(channel)
+        layer.feed(data)
+
+        return layer
+
+    def send(self, channel: int, data: Buffer) -> None:
+        with self._send_lock:
+            self._underlying.send_channel(channel, data)
@@ -1,7 +1,14 @@
-from collections.abc import Buffer
-from typing import Protocol
+import bz2
+import lzma
+import zlib
+from collections.abc import Buffer, Callable, Mapping, Sequence
+from dataclasses import dataclass
+from enum import IntEnum
+from time import perf_counter
+from typing import Protocol, Self
 
-from .typing import SizedProtocolLayer
+from ..instrumentation import Instrumented
+from .typing import AsyncSizedProtocolLayer, SizedProtocolLayer
 
 
 class Compressor(Protocol):
@@ -9,27 +16,296 @@ class Compressor(Protocol):
     def decompress(self, data: Buffer, /) -> bytes: ...
 
 
-class CompressionLayer:
-    _underlying: SizedProtocolLayer
+class IdentityCompressor:
+    @staticmethod
+    def compress(data: Buffer, /) -> bytes:
+        return bytes(data)
+
+    @staticmethod
+    def decompress(data: Buffer, /) -> bytes:
+        return bytes(data)
+
+
+@dataclass(frozen=True)
+class ZlibCompressor:
+    level: int = zlib.Z_DEFAULT_COMPRESSION
+
+    def compress(self, data: Buffer, /) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: Buffer, /) -> bytes:
+        return zlib.decompress(data)
+
+
+# raw deflate blocks end with this marker after a sync flush, it is implied on
+# the wire.
+_SYNC_FLUSH_MARKER = b"\x00\x00\xff\xff"
+
+# text which shows up in most responses, used to prime the deflate window.
+PRESET_DICTIONARY = b"".join(
+    (
+        b"<function <lambda> at 0x<class '<module '<built-in function None True False ",
+        b"IndexError: list index out of range\n",
+        b"ZeroDivisionError: division by zero\n",
+        b"KeyError: AttributeError: object has no attribute ",
+        b"TypeError: unsupported operand type(s) for +: 'int' and 'str'\n",
+        b"ValueError: invalid literal for int() with base 10: ",
+        b"SyntaxError: invalid syntax\n",
+        b"    ^^^^^^^^^^^^^^^^^^^^\n",
+        b"NameError: name ' is not defined\n",
+        b"  File \"<string>\", line 1, in <module>\n",
+        b'  File "backend/application.py", line ',
+        b"Traceback (most recent call last):\n",
+    )
+)
+
+
+class StreamingZlibCompressor:
+    _compressobj: "zlib._Compress"
+    _decompressobj: "zlib._Decompress"
+
+    def __init__(
+        self, level: int = zlib.Z_DEFAULT_COMPRESSION, zdict: bytes | None = None
+    ) -> None:
+        options = {} if zdict is None else {"zdict": zdict}
+
+        self._compressobj = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, **options
+        )
+        self._decompressobj = zlib.decompressobj(-zlib.MAX_WBITS, **options)
+
+    def compress(self, data: Buffer, /) -> bytes:
+        compressed = self._compressobj.compress(data)
+        compressed += self._compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+        return compressed[: -len(_SYNC_FLUSH_MARKER)]
+
+    def decompress(self, data: Buffer, /) -> bytes:
+        data = self._decompressobj.decompress(data)
+        data += self._decompressobj.decompress(_SYNC_FLUSH_MARKER)
+
+        return data
+
+
+class Codec(IntEnum):
+    IDENTITY = 0
+    ZLIB_FAST = 1
+    ZLIB = 2
+    ZLIB_BEST = 3
+    BZ2 = 4
+    LZMA = 5
+    ZLIB_STREAM = 6
+    ZLIB_STREAM_DICT = 7
+
+
+# stateful codecs need their own instance per connection, hence factories.
+CODECS: dict[Codec, Callable[[], Compressor]] = {
+    Codec.IDENTITY: IdentityCompressor,
+    Codec.ZLIB_FAST: lambda: ZlibCompressor(1),
+    Codec.ZLIB: ZlibCompressor,
+    Codec.ZLIB_BEST: lambda: ZlibCompressor(9),
+    Codec.BZ2: lambda: bz2,
+    Codec.LZMA: lambda: lzma,
+    Codec.ZLIB_STREAM: StreamingZlibCompressor,
+    Codec.ZLIB_STREAM_DICT: lambda: StreamingZlibCompressor(zdict=PRESET_DICTIONARY),
+}
+
+# messages below this size are sent as they are.
+DEFAULT_THRESHOLD = 64
+
+# smaller messages are simply compressed, the probe would cost about as much.
+PROBE_MIN_SIZE = 1 << 14
+
+PROBE_SAMPLE_SIZE = 1024
+
+# a sample which does not shrink below this ratio is considered incompressible.
+PROBE_RATIO = 0.9
+
+
+def is_compressible(data: Buffer) -> bool:
+    sample = memoryview(data)[:PROBE_SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * PROBE_RATIO
+
+
+class _CompressionLayerBase(Instrumented):
     _compressor: Compressor
+    _codec: Codec | None
+    _codecs: Mapping[Codec, Compressor]
+    _threshold: int
+
+    def __init__(
+        self,
+        compressor: Compressor,
+        codec: Codec | None,
+        codecs: Mapping[Codec, Compressor] | None,
+        threshold: int,
+    ) -> None:
+        if codecs is None:
+            codecs = {codec: factory() for codec, factory in CODECS.items()}
 
-    def __init__(self, underlying: SizedProtocolLayer, compressor: Compressor) -> None:
-        self._underlying = underlying
         self._compressor = compressor
+        self._codec = codec
+        self._codecs = codecs
+        self._threshold = threshold
+
+    @property
+    def compressor(self) -> Compressor:
+        return self._compressor
+
+    @property
+    def codec(self) -> Codec | None:
+        return self._codec
+
+    @staticmethod
+    def _agree(
+        codecs: Sequence[Codec], other_codecs: Buffer
+    ) -> tuple[Codec, dict[Codec, Compressor]]:
+        accepted = {Codec(codec) for codec in memoryview(other_codecs)}
+        accepted.add(Codec.IDENTITY)
+
+        # the first codec in our preference order which the peer can decode.
+        codec = next((codec for codec in codecs if codec in accepted), Codec.IDENTITY)
+
+        return codec, {codec: factory() for codec, factory in CODECS.items()}
+
+    def _choose(self, data: memoryview) -> tuple[Codec, Buffer]:
+        assert self._codec is not None
+
+        if self._codec is Codec.IDENTITY or len(data) < self._threshold:
+            return Codec.IDENTITY, data
+
+        if len(data) >= PROBE_MIN_SIZE and not is_compressible(data):
+            return Codec.IDENTITY, data
+
+        compressed = self._compressor.compress(data)
+
+        # a streaming context has already absorbed the data, it must be sent.
+        if isinstance(self._compressor, StreamingZlibCompressor):
+            return self._codec, compressed
+
+        if len(compressed) >= len(data):
+            return Codec.IDENTITY, data
+
+        return self._codec, compressed
+
+    def _encode(self, data: Buffer) -> Buffer:
+        if self._stats is None:
+            return self._encode_message(data)
+
+        start = perf_counter()
+        encoded = self._encode_message(data)
+
+        self._stats.add("compress_seconds", perf_counter() - start)
+        self._stats.add("raw_bytes_out", memoryview(data).nbytes)
+        self._stats.add("bytes_out", memoryview(encoded).nbytes)
+
+        return encoded
+
+    def _decode(self, compressed: Buffer) -> bytes:
+        if self._stats is None:
+            return self._decode_message(compressed)
+
+        start = perf_counter()
+        data = self._decode_message(compressed)
+
+        self._stats.add("decompress_seconds", perf_counter() - start)
+        self._stats.add("raw_bytes_in", memoryview(data).nbytes)
+        self._stats.add("bytes_in", memoryview(compressed).nbytes)
+
+        return data
+
+    def _encode_message(self, data: Buffer) -> Buffer:
+        if self._codec is None:
+            return self._compressor.compress(data)
+
+        codec, payload = self._choose(memoryview(data))
+        return bytes((codec,)) + payload
+
+    def _decode_message(self, compressed: Buffer) -> bytes:
+        if self._codec is None:
+            return self._compressor.decompress(compressed)
+
+        compressed = memoryview(compressed)
+        codec, payload = Codec(compressed[0]), compressed[1:]
+
+        if codec is Codec.IDENTITY:
+            return bytes(payload)
+
+        data = self._codecs[codec].decompress(payload)
+        return data
+
+
+class CompressionLayer(_CompressionLayerBase):
+    _underlying: SizedProtocolLayer
+
+    def __init__(
+        self,
+        underlying: SizedProtocolLayer,
+        compressor: Compressor,
+        codec: Codec | None = None,
+        codecs: Mapping[Codec, Compressor] | None = None,
+        threshold: int = DEFAULT_THRESHOLD,
+    ) -> None:
+        super().__init__(compressor, codec, codecs, threshold)
+        self._underlying = underlying
 
     @property
     def underlying(self) -> SizedProtocolLayer:
         return self._underlying
 
-    @property
-    def compressor(self) -> Compressor:
-        return self._compressor
+    @classmethod
+    def initiate_connection(
+        cls,
+        underlying: SizedProtocolLayer,
+        codecs: Sequence[Codec],
+        threshold: int = DEFAULT_THRESHOLD,
+    ) -> Self:
+        underlying.send(bytes(codecs))
+        codec, compressors = cls._agree(codecs, underlying.recv())
+
+        return cls(underlying, compressors[codec], codec, compressors, threshold)
 
     def recv(self) -> bytes:
         compressed = self._underlying.recv()
-        data = self._compressor.decompress(compressed)
-        return data
+        return self._decode(compressed)
 
     def send(self, data: Buffer) -> None:
-        compressed = self._compressor.compress(data)
-        self._underlying.send(compressed)
+        self._underlying.send(self._encode(data))
+
+
+class AsyncCompressionLayer(_CompressionLayerBase):
+    _underlying: AsyncSizedProtocolLayer
+
+    def __init__(
+        self,
+        underlying: AsyncSizedProtocolLayer,
+        compressor: Compressor,
+        codec: Codec | None = None,
+        codecs: Mapping[Codec, Compressor] | None = None,
+        threshold: int = DEFAULT_THRESHOLD,
+    ) -> None:
+        super().__init__(compressor, codec, codecs, threshold)
+        self._underlying = underlying
+
+    @property
+    def underlying(self) -> AsyncSizedProtocolLayer:
+        return self._underlying
+
+    @classmethod
+    async def initiate_connection(
+        cls,
+        underlying: AsyncSizedProtocolLayer,
+        codecs: Sequence[Codec],
+        threshold: int = DEFAULT_THRESHOLD,
+    ) -> Self:
+        await underlying.send(bytes(codecs))
+        codec, compressors = cls._agree(codecs, await underlying.recv())
+
+        return cls(underlying, compressors[codec], codec, compressors, threshold)
+
+    async def recv(self) -> bytes:
+        compressed = await self._underlying.recv()
+        return self._decode(compressed)
+
+    async def send(self, data: Buffer) -> None:
+        await self._underlying.send(self._encode(data))
@@ -1,53 +1,88 @@
 from collections.abc import Buffer
-from itertools import count
 
-from .typing import UnsizedProtocolLayer
+from ..instrumentation import Instrumented
+from .typing import BufferedProtocolLayer
 
 
-class MessageLayer:
-    _underlying: UnsizedProtocolLayer
+def encode_varint(num: int) -> bytes:
+    buf = bytearray()
 
-    def __init__(self, underlying: UnsizedProtocolLayer) -> None:
+    while True:
+        byte = num & 127
+
+        if num >= 128:
+            byte |= 128
+
+        buf.append(byte)
+
+        num >>= 7
+
+        if not num:
+            break
+
+    return bytes(buf)
+
+
+class MessageLayer(Instrumented):
+    _underlying: BufferedProtocolLayer
+
+    def __init__(self, underlying: BufferedProtocolLayer) -> None:
         self._underlying = underlying
 
     @property
-    def underlying(self) -> UnsizedProtocolLayer:
+    def underlying(self) -> BufferedProtocolLayer:
         return self._underlying
 
     def _recv_varint(self) -> int:
         num = 0
+        size = 0
 
-        for i in count():
-            byte, *_ = self._underlying.recv(1)
+        while True:
+            size += 1
+            byte = self._underlying.peek(size)[-1]
 
-            num |= (byte & 127) << (i * 7)
+            num |= (byte & 127) << ((size - 1) * 7)
             if byte < 128:
                 break
 
-        return num
-
-    def _write_varint(self, num: int) -> None:
-        buf = bytearray()
-
-        while num:
-            byte = num & 127
+        self._underlying.consume(size)
 
-            if num >= 128:
-                byte |= 128
-
-            buf.append(byte)
+        return num
 
-            num >>= 7
+    def _count(self, direction: str, size: int) -> None:
+        assert self._stats is not None
 
-        self._underlying.sendall(buf)
+        self._stats.add(f"messages_{direction}")
+        self._stats.add(f"bytes_{direction}", size)
 
     def recv(self) -> bytes:
         size = self._recv_varint()
+
+        if self._stats is not None:
+            self._count("in", size)
+
         return self._underlying.recv(size)
 
     def send(self, data: Buffer) -> None:
         data = memoryview(data)
         size = len(data)
 
-        self._write_varint(size)
-        self._underlying.sendall(data)
+        if self._stats is not None:
+            self._count("out", size)
+
+        # one write so that small messages travel in a single record.
+        self._underlying.sendall_vectored((encode_varint(size), data))
+
+    def recv_channel(self) -> tuple[int, bytes]:
+        channel = self._recv_varint()
+        return channel, self.recv()
+
+    def send_channel(self, channel: int, data: Buffer) -> None:
+        data = memoryview(data)
+        size = len(data)
+
+        if self._stats is not None:
+            self._count("out", size)
+
+        header = encode_varint(channel) + encode_varint(size)
+        self._underlying.sendall_vectored((header, data))
@@ -1,7 +1,12 @@
 import secrets
 import struct
-from collections.abc import Buffer
-from typing import Self
+from collections import deque
+from collections.abc import Buffer, Callable, Iterable, Iterator, Sequence
+from concurrent.futures import Executor
+from enum import IntEnum
+from itertools import repeat
+from time import perf_counter
+from typing import Any, Self
 
 from cryptography.hazmat.primitives.asymmetric.x25519 import (
     X25519PrivateKey,
@@ -11,32 +16,106 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.hashes import SHA512
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-from .typing import UnsizedProtocolLayer
+from ..instrumentation import Instrumented
+from .typing import BufferedProtocolLayer
 
 
-class SecureLayer:
-    _underlying: UnsizedProtocolLayer
-    _cipher: AESGCM
-    _buffer: bytearray
+class RecordFraming(IntEnum):
+    BYTE = 1
+    SHORT = 2
+    LONG = 4
 
-    def __init__(self, underlying: UnsizedProtocolLayer, cipher: AESGCM) -> None:
-        self._underlying = underlying
+    @property
+    def header(self) -> struct.Struct:
+        return _RECORD_HEADERS[self]
+
+    @property
+    def max_size(self) -> int:
+        return _RECORD_MAX_SIZES[self]
+
+
+class NonceMode(IntEnum):
+    RANDOM = 0
+    COUNTER = 1
+
+
+_RECORD_HEADERS = {
+    RecordFraming.BYTE: struct.Struct(">12sB"),
+    RecordFraming.SHORT: struct.Struct(">12sH"),
+    RecordFraming.LONG: struct.Struct(">12sI"),
+}
+
+_RECORD_MAX_SIZES = {
+    RecordFraming.BYTE: 0xFF,
+    RecordFraming.SHORT: 0xFFFF,
+    RecordFraming.LONG: 1 << 20,
+}
+
+# direction (4 bytes) + record counter (8 bytes)
+_COUNTER_NONCE = struct.Struct(">IQ")
+
+
+SEND_BATCH_SIZE = 1 << 18
+
+# records handed to the executor at once when encrypting in parallel.
+PARALLEL_BATCH_RECORDS = 16
+
+
+class _SecureLayerBase(Instrumented):
+    _cipher: AESGCM
+    _framing: RecordFraming
+    _nonce_mode: NonceMode
+    _direction: int
+    _send_counter: int
+    _recv_counter: int
+    _executor: Executor | None
+    _batch_size: int
+    _chunks: deque[Buffer]
+    _offset: int
+    _available: int
+
+    def __init__(
+        self,
+        cipher: AESGCM,
+        framing: RecordFraming,
+        nonce_mode: NonceMode,
+        direction: int,
+        executor: Executor | None,
+    ) -> None:
         self._cipher = cipher
-        self._buffer = bytearray()
+        self._framing = framing
+        self._nonce_mode = nonce_mode
+        self._direction = direction
+        self._send_counter = 0
+        self._recv_counter = 0
+        self._executor = executor
+        self._batch_size = SEND_BATCH_SIZE
+        if executor is not None:
+            self._batch_size = max(
+                SEND_BATCH_SIZE, framing.max_size * PARALLEL_BATCH_RECORDS
+            )
+        self._chunks = deque()
+        self._offset = 0
+        self._available = 0
 
     @property
-    def underlying(self) -> UnsizedProtocolLayer:
-        return self._underlying
+    def framing(self) -> RecordFraming:
+        return self._framing
 
-    @classmethod
-    def initiate_connection(
-        cls, underlying: UnsizedProtocolLayer, key: X25519PrivateKey
-    ) -> Self:
-        my_public_key = key.public_key()
-        my_public_key_bytes = my_public_key.public_bytes_raw()
-        underlying.sendall(my_public_key_bytes)
+    @property
+    def nonce_mode(self) -> NonceMode:
+        return self._nonce_mode
 
-        other_public_key_bytes = underlying.recv(32)
+    @property
+    def executor(self) -> Executor | None:
+        return self._executor
+
+    @property
+    def buffered(self) -> int:
+        return self._available
+
+    @staticmethod
+    def _derive_cipher(key: X25519PrivateKey, other_public_key_bytes: bytes) -> AESGCM:
         other_public_key = X25519PublicKey.from_public_bytes(other_public_key_bytes)
 
         shared_secret = key.exchange(other_public_key)
@@ -47,67 +126,364 @@ class SecureLayer:
         symmetric_key = kdf.derive(shared_secret)
         cipher = AESGCM(symmetric_key)
 
-        return cls(underlying, cipher)
+        return cipher
+
+    @staticmethod
+    def _agree(
+        framing: RecordFraming,
+        nonce_mode: NonceMode,
+        other_options: Buffer,
+    ) -> tuple[RecordFraming, NonceMode]:
+        other_framing, other_nonce_mode = memoryview(other_options)
+        other_framing = RecordFraming(other_framing)
+        other_nonce_mode = NonceMode(other_nonce_mode)
+
+        return min(framing, other_framing), min(nonce_mode, other_nonce_mode)
+
+    @staticmethod
+    def _get_direction(my_public_key_bytes: bytes, other_public_key_bytes: bytes) -> int:
+        if my_public_key_bytes == other_public_key_bytes:
+            raise ValueError("peers must not share the same key.")
+
+        # both sides count from zero, so each direction gets its own nonce space.
+        return int(my_public_key_bytes > other_public_key_bytes)
 
     @staticmethod
     def _encrypt_nonce(nonce: Buffer) -> bytes:
         nonce = memoryview(nonce)
+        size = len(nonce)
 
-        if not nonce:
-            return b""
+        # prefix xor over the whole nonce, log2(size) big-int steps.
+        value = int.from_bytes(nonce, "big")
 
-        result = bytearray()
+        shift = 8
+        while shift < size * 8:
+            value ^= value >> shift
+            shift <<= 1
 
-        result.append(nonce[0])
-        for ch in nonce[1:]:
-            result.append(ch ^ result[-1])
-
-        return bytes(result)
+        return value.to_bytes(size, "big")
 
     @staticmethod
     def _decrypt_nonce(nonce: Buffer) -> bytes:
         nonce = memoryview(nonce)
+        size = len(nonce)
 
-        if not nonce:
-            return b""
+        value = int.from_bytes(nonce, "big")
+        value ^= value >> 8
 
-        result = bytes((nonce[0], *(a ^ b for a, b in zip(nonce, nonce[1:]))))
-        return bytes(result)
+        return value.to_bytes(size, "big")
 
-    def _recv_block(self) -> None:
-        header = self._underlying.recv(13)
-        nonce, size = struct.unpack(">12sB", header)
+    def _map(
+        self, func: Callable[..., bytes], *iterables: Iterable[Any]
+    ) -> Iterator[bytes]:
+        if self._executor is None:
+            return map(func, *iterables)
 
-        nonce = self._decrypt_nonce(nonce)
-        ciphertext = self._underlying.recv(size + 16)
+        return self._executor.map(func, *iterables)
 
-        plaintext = self._cipher.decrypt(nonce, ciphertext, None)
+    def _next_nonce(self) -> bytes:
+        if self._nonce_mode is NonceMode.RANDOM:
+            return secrets.token_bytes(12)
 
-        self._buffer.extend(plaintext)
+        nonce = _COUNTER_NONCE.pack(self._direction, self._send_counter)
+        self._send_counter += 1
 
-    def recv(self, bufsize: int) -> bytes:
-        while len(self._buffer) < bufsize:
-            self._recv_block()
+        return nonce
 
-        buffer = memoryview(self._buffer[:bufsize])
-        self._buffer = self._buffer[bufsize:]
+    def _check_nonce(self, nonce: bytes) -> None:
+        if self._nonce_mode is NonceMode.RANDOM:
+            return
 
-        return buffer
+        expected = _COUNTER_NONCE.pack(1 - self._direction, self._recv_counter)
 
-    def sendall(self, data: Buffer) -> None:
-        data = memoryview(data)
+        if nonce != expected:
+            raise ValueError("unexpected record nonce.")
+
+        self._recv_counter += 1
+
+    def _record_size(self, header: Buffer) -> int:
+        header_struct = self._framing.header
+        _, size = header_struct.unpack(header)
+
+        if size > self._framing.max_size:
+            raise ValueError(f"record size {size} exceeds the negotiated limit.")
+
+        return header_struct.size + size + 16
+
+    def _complete_records(self, buffered: memoryview) -> list[memoryview]:
+        header_size = self._framing.header.size
+
+        records: list[memoryview] = []
+        offset = 0
+
+        while len(buffered) - offset >= header_size:
+            record_size = self._record_size(buffered[offset : offset + header_size])
+
+            if len(buffered) - offset < record_size:
+                break
+
+            records.append(buffered[offset : offset + record_size])
+            offset += record_size
+
+        return records
+
+    def _open_records(self, records: list[memoryview]) -> int:
+        header_struct = self._framing.header
+        start = perf_counter() if self._stats is not None else 0.0
+        available = self._available
+
+        nonces: list[bytes] = []
+        ciphertexts: list[memoryview] = []
+
+        for record in records:
+            nonce, _ = header_struct.unpack(record[: header_struct.size])
+
+            nonce = self._decrypt_nonce(nonce)
+            self._check_nonce(nonce)
+
+            nonces.append(nonce)
+            ciphertexts.append(record[header_struct.size :])
+
+        plaintexts = self._map(self._cipher.decrypt, nonces, ciphertexts, repeat(None))
+
+        for plaintext in plaintexts:
+            if plaintext:
+                self._chunks.append(plaintext)
+                self._available += len(plaintext)
+
+        size = sum(map(len, records))
+
+        if self._stats is not None:
+            self._stats.add("decrypt_seconds", perf_counter() - start)
+            self._stats.add("records_in", len(records))
+            self._stats.add("bytes_in", self._available - available)
+            self._stats.add("wire_bytes_in", size)
+
+        return size
+
+    @staticmethod
+    def _split_records(buffers: Iterable[Buffer], max_size: int) -> Iterator[Buffer]:
+        parts: list[memoryview] = []
+        pending = 0
+
+        for buffer in buffers:
+            view = memoryview(buffer).cast("B")
+
+            while view:
+                part, view = view[: max_size - pending], view[max_size - pending :]
 
-        while data:
-            plaintext, data = data[:255], data[255:]
+                parts.append(part)
+                pending += len(part)
 
-            size = len(plaintext)
+                if pending == max_size:
+                    yield parts[0] if len(parts) == 1 else b"".join(parts)
 
-            nonce = secrets.token_bytes(12)
-            ciphertext = self._cipher.encrypt(nonce, plaintext, None)
+                    parts.clear()
+                    pending = 0
 
+        if parts:
+            yield parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def _batches(self, buffers: Iterable[Buffer]) -> Iterator[list[Buffer]]:
+        plaintexts = self._split_records(buffers, self._framing.max_size)
+        batch: list[Buffer] = []
+        pending = 0
+
+        for plaintext in plaintexts:
+            batch.append(plaintext)
+            pending += len(plaintext)
+
+            if pending >= self._batch_size:
+                yield batch
+
+                batch = []
+                pending = 0
+
+        if batch:
+            yield batch
+
+    def _seal_records(self, plaintexts: list[Buffer]) -> list[Buffer]:
+        header_struct = self._framing.header
+        start = perf_counter() if self._stats is not None else 0.0
+
+        nonces = [self._next_nonce() for _ in plaintexts]
+        ciphertexts = self._map(self._cipher.encrypt, nonces, plaintexts, repeat(None))
+
+        records: list[Buffer] = []
+
+        for nonce, plaintext, ciphertext in zip(nonces, plaintexts, ciphertexts):
             nonce = self._encrypt_nonce(nonce)
 
-            packed = struct.pack(">12sB", nonce, size)
-            packed += ciphertext
+            records.append(header_struct.pack(nonce, len(plaintext)))
+            records.append(ciphertext)
+
+        if self._stats is not None:
+            self._stats.add("encrypt_seconds", perf_counter() - start)
+            self._stats.add("records_out", len(plaintexts))
+            self._stats.add("bytes_out", sum(map(len, plaintexts)))
+            self._stats.add("wire_bytes_out", sum(map(len, records)))
+
+        return records
+
+    def _consume(self, size: int) -> None:
+        self._offset += size
+        self._available -= size
+
+        if self._offset == len(self._chunks[0]):
+            self._chunks.popleft()
+            self._offset = 0
+
+    def _coalesce(self, size: int) -> None:
+        head = memoryview(self._chunks.popleft())[self._offset :]
+
+        parts = [head]
+        missing = size - len(head)
+
+        while missing > 0:
+            chunk = memoryview(self._chunks.popleft())
+            part, rest = chunk[:missing], chunk[missing:]
+
+            parts.append(part)
+            missing -= len(part)
+
+            if rest:
+                self._chunks.appendleft(rest)
+
+        self._chunks.appendleft(b"".join(parts))
+        self._offset = 0
+
+    def _copy_buffered(self, buffer: memoryview) -> None:
+        while buffer:
+            head = memoryview(self._chunks[0])[self._offset :]
+            size = min(len(head), len(buffer))
+
+            buffer[:size] = head[:size]
+            buffer = buffer[size:]
+
+            self._consume(size)
+
+    def _peek_buffered(self, size: int) -> memoryview:
+        if not size:
+            return memoryview(b"")
+
+        if len(self._chunks[0]) - self._offset < size:
+            self._coalesce(size)
+
+        return memoryview(self._chunks[0])[self._offset : self._offset + size]
+
+    def _take_buffered(self, size: int) -> memoryview:
+        if not size:
+            return memoryview(b"")
+
+        head = memoryview(self._chunks[0])[self._offset :]
+
+        # the common case: the whole read lies within a single record.
+        if len(head) >= size:
+            self._consume(size)
+            return head[:size]
+
+        buffer = memoryview(bytearray(size))
+        self._copy_buffered(buffer)
+
+        return buffer
+
+    def consume(self, size: int) -> None:
+        if size > self._available:
+            raise ValueError("cannot consume more than what is buffered.")
+
+        while size:
+            nbytes = min(size, len(self._chunks[0]) - self._offset)
+            self._consume(nbytes)
+            size -= nbytes
+
+
+class SecureLayer(_SecureLayerBase):
+    _underlying: BufferedProtocolLayer
+
+    def __init__(
+        self,
+        underlying: BufferedProtocolLayer,
+        cipher: AESGCM,
+        framing: RecordFraming = RecordFraming.BYTE,
+        nonce_mode: NonceMode = NonceMode.RANDOM,
+        direction: int = 0,
+        executor: Executor | None = None,
+    ) -> None:
+        super().__init__(cipher, framing, nonce_mode, direction, executor)
+        self._underlying = underlying
+
+    @property
+    def underlying(self) -> BufferedProtocolLayer:
+        return self._underlying
+
+    @classmethod
+    def initiate_connection(
+        cls,
+        underlying: BufferedProtocolLayer,
+        key: X25519PrivateKey,
+        framing: RecordFraming | None = None,
+        nonce_mode: NonceMode | None = None,
+        executor: Executor | None = None,
+    ) -> Self:
+        my_public_key = key.public_key()
+        my_public_key_bytes = my_public_key.public_bytes_raw()
+        underlying.sendall(my_public_key_bytes)
+
+        other_public_key_bytes = underlying.recv(32)
+        cipher = cls._derive_cipher(key, other_public_key_bytes)
+
+        # peers which don't know about negotiation (e.g. the frontend) only
+        # speak the original 255-byte records with random nonces.
+        if framing is None and nonce_mode is None:
+            return cls(underlying, cipher, executor=executor)
+
+        framing = framing or RecordFraming.BYTE
+        nonce_mode = nonce_mode or NonceMode.RANDOM
+
+        underlying.sendall(bytes((framing, nonce_mode)))
+        framing, nonce_mode = cls._agree(framing, nonce_mode, underlying.recv(2))
 
-            self._underlying.sendall(packed)
+        direction = cls._get_direction(my_public_key_bytes, other_public_key_bytes)
+
+        return cls(underlying, cipher, framing, nonce_mode, direction, executor)
+
+    def _recv_blocks(self) -> None:
+        # wait for one record, then take along every record which is already
+        # complete in the transport buffer so they can be decrypted as a batch.
+        header = self._underlying.peek(self._framing.header.size)
+        self._underlying.peek(self._record_size(header))
+
+        buffered = self._underlying.peek(self._underlying.buffered)
+        records = self._complete_records(buffered)
+
+        self._underlying.consume(self._open_records(records))
+
+    def peek(self, size: int) -> memoryview:
+        while self._available < size:
+            self._recv_blocks()
+
+        return self._peek_buffered(size)
+
+    def recv(self, bufsize: int) -> bytes:
+        while self._available < bufsize:
+            self._recv_blocks()
+
+        return self._take_buffered(bufsize)
+
+    def recv_into(self, buffer: Buffer, /) -> int:
+        buffer = memoryview(buffer).cast("B")
+        nbytes = len(buffer)
+
+        while self._available < nbytes:
+            self._recv_blocks()
+
+        self._copy_buffered(buffer)
+
+        return nbytes
+
+    def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None:
+        for batch in self._batches(buffers):
+            self._underlying.sendall_vectored(self._seal_records(batch))
+
+    def sendall(self, data: Buffer) -> None:
+        self.sendall_vectored((data,))
@@ -0,0 +1,135 @@
+import socket
+from collections import deque
+from collections.abc import Buffer, Sequence
+from itertools import islice
+
+from ..instrumentation import Instrumented
+from .typing import UnsizedProtocolLayer
+
+DEFAULT_BUFFER_SIZE = 1 << 18
+
+# stay well below IOV_MAX (1024 on linux) for a single sendmsg call.
+MAX_IOVECS = 512
+
+
+class _TransportLayerBase(Instrumented):
+    _buffer: bytearray
+    _start: int
+    _end: int
+
+    def __init__(self, bufsize: int) -> None:
+        self._buffer = bytearray(bufsize)
+        self._start = 0
+        self._end = 0
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _compact(self, size: int) -> None:
+        pending = self._end - self._start
+
+        if size > len(self._buffer):
+            # never resize in place, views handed out by peek() may still exist.
+            buffer = bytearray(size)
+        else:
+            buffer = self._buffer
+
+        buffer[:pending] = self._buffer[self._start : self._end]
+
+        self._buffer = buffer
+        self._start = 0
+        self._end = pending
+
+    def consume(self, size: int) -> None:
+        if size > self._end - self._start:
+            raise ValueError("cannot consume more than what is buffered.")
+
+        self._start += size
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+
+class TransportLayer(_TransportLayerBase):
+    _underlying: UnsizedProtocolLayer
+
+    def __init__(
+        self, underlying: UnsizedProtocolLayer, bufsize: int = DEFAULT_BUFFER_SIZE
+    ) -> None:
+        super().__init__(bufsize)
+        self._underlying = underlying
+
+    @property
+    def underlying(self) -> UnsizedProtocolLayer:
+        return self._underlying
+
+    def _fill(self, size: int) -> None:
+        while self._end - self._start < size:
+            if len(self._buffer) - self._start < size:
+                self._compact(size)
+
+            view = memoryview(self._buffer)[self._end :]
+            nbytes = self._underlying.recv_into(view)
+
+            if not nbytes:
+                raise EOFError("connection closed by peer.")
+
+            self._end += nbytes
+
+            if self._stats is not None:
+                self._stats.add("reads")
+                self._stats.add("bytes_in", nbytes)
+
+    def peek(self, size: int) -> memoryview:
+        self._fill(size)
+        return memoryview(self._buffer)[self._start : self._start + size]
+
+    def recv(self, bufsize: int) -> bytes:
+        data = bytes(self.peek(bufsize))
+        self.consume(bufsize)
+        return data
+
+    def recv_into(self, buffer: Buffer, /) -> int:
+        buffer = memoryview(buffer).cast("B")
+        nbytes = len(buffer)
+
+        buffer[:] = self.peek(nbytes)
+        self.consume(nbytes)
+
+        return nbytes
+
+    def sendall(self, data: Buffer) -> None:
+        self._underlying.sendall(data)
+
+        if self._stats is not None:
+            self._stats.add("writes")
+            self._stats.add("bytes_out", memoryview(data).nbytes)
+
+    def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None:
+        if not isinstance(self._underlying, socket.socket):
+            self.sendall(b"".join(buffers))
+            return
+
+        views = deque(memoryview(buffer).cast("B") for buffer in buffers)
+
+        while views:
+            if not views[0]:
+                views.popleft()
+                continue
+
+            nbytes = self._underlying.sendmsg(list(islice(views, MAX_IOVECS)))
+
+            if self._stats is not None:
+                self._stats.add("writes")
+                self._stats.add("bytes_out", nbytes)
+
+            while nbytes:
+                head = views[0]
+
+                if nbytes < len(head):
+                    views[0] = head[nbytes:]
+                    break
+
+                nbytes -= len(head)
+                views.popleft()
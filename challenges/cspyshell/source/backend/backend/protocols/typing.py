@@ -1,12 +1,44 @@
-from collections.abc import Buffer
+from collections.abc import Buffer, Sequence
 from typing import Protocol
 
 
 class UnsizedProtocolLayer(Protocol):
     def recv(self, bufsize: int, /) -> bytes: ...
+    def recv_into(self, buffer: Buffer, /) -> int: ...
     def sendall(self, data: Buffer, /) -> None: ...
 
 
+class BufferedProtocolLayer(UnsizedProtocolLayer, Protocol):
+    @property
+    def buffered(self) -> int: ...
+    def peek(self, size: int, /) -> memoryview: ...
+    def consume(self, size: int, /) -> None: ...
+    def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None: ...
+
+
 class SizedProtocolLayer(Protocol):
     def recv(self, /) -> bytes: ...
     def send(self, data: Buffer, /) -> None: ...
+
+
+class ChannelProtocolLayer(Protocol):
+    def recv_channel(self, /) -> tuple[int, bytes]: ...
+    def send_channel(self, channel: int, data: Buffer, /) -> None: ...
+
+
+class AsyncUnsizedProtocolLayer(Protocol):
+    async def recv(self, bufsize: int, /) -> bytes: ...
+    async def sendall(self, data: Buffer, /) -> None: ...
+
+
+class AsyncBufferedProtocolLayer(AsyncUnsizedProtocolLayer, Protocol):
+    @property
+    def buffered(self) -> int: ...
+    async def peek(self, size: int, /) -> memoryview: ...
+    def consume(self, size: int, /) -> None: ...
+    async def sendall_vectored(self, buffers: Sequence[Buffer], /) -> None: ...
+
+
+class AsyncSizedProtocolLayer(Protocol):
+    async def recv(self, /) -> bytes: ...
+    async def send(self, data: Buffer, /) -> None: ...
@@ -0,0 +1,169 @@
+import builtins
+import importlib
+import os
+import pickle
+import struct
+import threading
+import zlib
+from collections.abc import Mapping
+from enum import IntEnum
+from types import ModuleType
+from typing import Any, BinaryIO, Self
+
+_MAGIC = b"CSPYSNAP"
+
+# magic + size of the pickled index which follows it.
+_HEADER = struct.Struct(">8sI")
+
+COMPRESSION_LEVEL = 1
+
+
+class EntryKind(IntEnum):
+    VALUE = 0
+    MODULE = 1
+
+
+class _SnapshotBuiltins(dict[str, Any]):
+    _snapshot: "Snapshot"
+
+    def __init__(self, snapshot: "Snapshot") -> None:
+        super().__init__(builtins.__dict__)
+        self._snapshot = snapshot
+
+    def __missing__(self, name: str) -> Any:
+        # only names which are in neither the session nor the real builtins
+        # end up here, every other lookup stays on the fast path.
+        return self._snapshot.load(name)
+
+
+class Snapshot:
+    _fp: BinaryIO
+    _entries: dict[str, tuple[EntryKind, int, int]]
+    _variables: dict[str, Any] | None
+    _lock: threading.Lock
+
+    def __init__(
+        self, fp: BinaryIO, entries: dict[str, tuple[EntryKind, int, int]]
+    ) -> None:
+        self._fp = fp
+        self._entries = entries
+        self._variables = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str) -> Self:
+        fp = open(path, "rb")
+
+        magic, index_size = _HEADER.unpack(fp.read(_HEADER.size))
+        if magic != _MAGIC:
+            fp.close()
+            raise ValueError("not a session snapshot.")
+
+        index: list[tuple[str, EntryKind, int]] = pickle.loads(fp.read(index_size))
+
+        entries: dict[str, tuple[EntryKind, int, int]] = {}
+        offset = _HEADER.size + index_size
+
+        for name, kind, size in index:
+            entries[name] = EntryKind(kind), offset, size
+            offset += size
+
+        return cls(fp, entries)
+
+    @property
+    def pending(self) -> list[str]:
+        return list(self._entries)
+
+    def attach(self, variables: dict[str, Any]) -> None:
+        self._variables = variables
+        variables["__builtins__"] = _SnapshotBuiltins(self)
+
+    def raw(self, name: str) -> tuple[EntryKind, bytes]:
+        kind, offset, size = self._entries[name]
+
+        self._fp.seek(offset)
+        return kind, self._fp.read(size)
+
+    def load(self, name: str) -> Any:
+        with self._lock:
+            kind, payload = self.raw(name)
+            del self._entries[name]
+
+            match kind:
+                case EntryKind.VALUE:
+                    value = pickle.loads(zlib.decompress(payload))
+                case EntryKind.MODULE:
+                    value = importlib.import_module(payload.decode("utf-8"))
+
+            if self._variables is not None:
+                self._variables.setdefault(name, value)
+
+            self._detach_if_done()
+            return value
+
+    def discard_shadowed(self) -> None:
+        if self._variables is None or not self._entries:
+            return
+
+        with self._lock:
+            # a session variable hides the stored value for good, it must not
+            # come back once that variable is deleted.
+            for name in self._entries.keys() & self._variables.keys():
+                del self._entries[name]
+
+            self._detach_if_done()
+
+    def _detach_if_done(self) -> None:
+        if self._variables is not None and not self._entries:
+            # fully loaded, lookups no longer need to pass through here.
+            self._variables["__builtins__"] = builtins
+            self._fp.close()
+
+
+def _encode(value: Any) -> tuple[EntryKind, bytes]:
+    if isinstance(value, ModuleType):
+        return EntryKind.MODULE, value.__name__.encode("utf-8")
+
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return EntryKind.VALUE, zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def save_snapshot(
+    variables: Mapping[str, Any], path: str, snapshot: Snapshot | None = None
+) -> list[str]:
+    entries: dict[str, tuple[EntryKind, bytes]] = {}
+    skipped: list[str] = []
+
+    for name, value in variables.items():
+        if name == "__builtins__":
+            continue
+
+        try:
+            entries[name] = _encode(value)
+        except Exception:
+            # functions and classes defined in the session, open files, ...
+            skipped.append(name)
+
+    # entries which were never touched are carried over without unpickling.
+    if snapshot is not None:
+        for name in snapshot.pending:
+            if name not in variables:
+                entries[name] = snapshot.raw(name)
+
+    index = pickle.dumps(
+        [(name, kind, len(payload)) for name, (kind, payload) in entries.items()]
+    )
+
+    temporary = f"{path}.tmp"
+
+    with open(temporary, "wb") as fp:
+        fp.write(_HEADER.pack(_MAGIC, len(index)))
+        fp.write(index)
+
+        for _, payload in entries.values():
+            fp.write(payload)
+
+    # the old file stays readable through already opened snapshots.
+    os.replace(temporary, path)
+
+    return skipped
@@ -0,0 +1,117 @@
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+RESULT_CHUNK_SIZE = 1 << 16
+
+# characters or bytes of a string escaped at once.
+STRING_SLICE_SIZE = 1 << 13
+
+
+def _iter_string_repr(obj: str | bytes) -> Iterator[str]:
+    # the quote depends on the whole string, just like repr() picks it.
+    single, double = ("'", '"') if isinstance(obj, str) else (b"'", b'"')
+    quote = '"' if single in obj and double not in obj else "'"
+
+    if isinstance(obj, bytes):
+        yield "b"
+
+    yield quote
+
+    for start in range(0, len(obj), STRING_SLICE_SIZE):
+        text = repr(obj[start : start + STRING_SLICE_SIZE])
+        body = text[text.index(text[-1]) + 1 : -1]
+
+        # a slice quoted differently leaves our quote unescaped.
+        if text[-1] != quote:
+            body = body.replace(quote, "\\" + quote)
+
+        yield body
+
+    yield quote
+
+
+def _iter_items(items: Iterable[Any], active: set[int]) -> Iterator[str]:
+    for i, item in enumerate(items):
+        if i:
+            yield ", "
+
+        yield from _iter_repr(item, active)
+
+
+def _iter_repr(obj: Any, active: set[int]) -> Iterator[str]:
+    kind = type(obj)
+
+    if kind is str or kind is bytes:
+        yield from _iter_string_repr(obj)
+        return
+
+    # subclasses may override __repr__, only the builtin containers are split.
+    if kind not in (list, tuple, dict, set, frozenset):
+        yield repr(obj)
+        return
+
+    if id(obj) in active:
+        yield {list: "[...]", tuple: "(...)", dict: "{...}"}.get(kind, "...")
+        return
+
+    active.add(id(obj))
+
+    try:
+        if kind is list:
+            yield "["
+            yield from _iter_items(obj, active)
+            yield "]"
+        elif kind is tuple:
+            yield "("
+            yield from _iter_items(obj, active)
+            yield ",)" if len(obj) == 1 else ")"
+        elif kind is dict:
+            yield "{"
+            for i, (key, value) in enumerate(obj.items()):
+                if i:
+                    yield ", "
+
+                yield from _iter_repr(key, active)
+                yield ": "
+                yield from _iter_repr(value, active)
+            yield "}"
+        elif not obj:
+            yield f"{kind.__name__}()"
+        else:
+            prefix, suffix = ("{", "}") if kind is set else ("frozenset({", "})")
+
+            yield prefix
+            yield from _iter_items(obj, active)
+            yield suffix
+    finally:
+        active.discard(id(obj))
+
+
+def iter_repr(obj: Any) -> Iterator[str]:
+    return _iter_repr(obj, set())
+
+
+def encode_chunks(pieces: Iterable[str], size: int = RESULT_CHUNK_SIZE) -> Iterator[bytes]:
+    parts: list[str] = []
+    pending = 0
+
+    for piece in pieces:
+        start = 0
+
+        # a piece longer than what is left of the chunk is split across chunks.
+        while pending + len(piece) - start >= size:
+            end = start + size - pending
+            parts.append(piece[start:end])
+
+            yield "".join(parts).encode("utf-8")
+
+            parts.clear()
+            pending = 0
+            start = end
+
+        if start < len(piece):
+            parts.append(piece[start:])
+            pending += len(piece) - start
+
+    if parts:
+        yield "".join(parts).encode("utf-8")
@@ -17,5 +17,4 @@ def clear_files() -> None:
 
 
 if __name__ == "__main__":
-    clear_files()
-    main.main()
+    main.main(clear_files)
@@ -1,14 +1,30 @@
+import argparse
+import asyncio
+import json
+import os
 import re
 import subprocess
+import sys
 import time
-from random import SystemRandom
-from typing import Sequence
+from collections.abc import Callable
+from random import Random, SystemRandom
+from typing import Any, Sequence
 
 SHELL_PATH = "dist/cspyshell"
 
 WORD_PER_MINUTE = 70
 WAIT_ERROR = 5
 
+SOURCE_PATH = os.path.dirname(os.path.abspath(__file__))
+BACKEND_PATH = os.path.join(SOURCE_PATH, "backend")
+# backend/main.py would delete itself when not run by an interpreter named python.
+BACKEND_COMMAND = [sys.executable, "-c", "from backend import main; main.main()"]
+
+# a backend which has not connected by then counts as an error.
+CONNECT_TIMEOUT = 10.0
+
+PERCENTILES = (50, 90, 99)
+
 
 def strip_codes(codes: Sequence[str]) -> list[str]:
     return [
@@ -64,7 +80,257 @@ with open("flag.txt", "rb") as fp:
 )
 
 
+def typing_pace(code: str, random: Random) -> tuple[int, int]:
+    word_count = len(re.findall(r"[\w\d]+", code))
+    wpm = WORD_PER_MINUTE + random.randint(-WAIT_ERROR, WAIT_ERROR)
+    return word_count, wpm
+
+
+def typing_time(code: str, random: Random) -> float:
+    word_count, wpm = typing_pace(code, random)
+    return (word_count / wpm) * 60
+
+
+# seconds to wait before sending a command, given the command and the mean.
+THINK_TIMES: dict[str, Callable[[str, Random, float], float]] = {
+    "none": lambda code, random, mean: 0.0,
+    "constant": lambda code, random, mean: mean,
+    "uniform": lambda code, random, mean: random.uniform(0, 2 * mean),
+    "exponential": lambda code, random, mean: (
+        random.expovariate(1 / mean) if mean else 0
+    ),
+    "typing": lambda code, random, mean: typing_time(code, random),
+}
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    # nearest rank on sorted values.
+    rank = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(rank)]
+
+
+async def connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Any:
+    # the backend package is only needed to generate load.
+    if BACKEND_PATH not in sys.path:
+        sys.path.insert(0, BACKEND_PATH)
+
+    import zlib
+
+    from backend.protocols.async_message import AsyncMessageLayer
+    from backend.protocols.async_secure import AsyncSecureLayer
+    from backend.protocols.async_transport import AsyncTransportLayer
+    from backend.protocols.compression import AsyncCompressionLayer
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+    # exactly what the frontend speaks.
+    transport_layer = AsyncTransportLayer(reader, writer)
+    secure_layer = await AsyncSecureLayer.initiate_connection(
+        transport_layer, X25519PrivateKey.generate()
+    )
+    message_layer = AsyncMessageLayer(secure_layer)
+
+    return AsyncCompressionLayer(message_layer, zlib)
+
+
+class LoadGenerator:
+    _args: argparse.Namespace
+    _transcripts: list[list[str]]
+    _latencies: dict[tuple[int, int], list[float]]
+    _transferred: int
+    _errors: int
+
+    def __init__(self, args: argparse.Namespace, transcripts: list[list[str]]) -> None:
+        self._args = args
+        self._transcripts = transcripts
+        self._latencies = {}
+        self._transferred = 0
+        self._errors = 0
+
+    async def _start_backend(
+        self,
+    ) -> tuple[asyncio.subprocess.Process, asyncio.StreamReader, asyncio.StreamWriter]:
+        connection: asyncio.Future[tuple[asyncio.StreamReader, asyncio.StreamWriter]]
+        connection = asyncio.get_running_loop().create_future()
+
+        def accept(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            if connection.done():
+                writer.close()
+            else:
+                connection.set_result((reader, writer))
+
+        # one listener per session, so that it talks to the backend it started.
+        server = await asyncio.start_server(accept, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        env = dict(os.environ)
+        paths = BACKEND_PATH, env.get("PYTHONPATH")
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, paths))
+        if self._args.pool:
+            env["BACKEND_POOL"] = self._args.pool
+
+        process = await asyncio.create_subprocess_exec(
+            *self._args.backend,
+            "127.0.0.1",
+            str(port),
+            cwd=SOURCE_PATH,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        exited = asyncio.ensure_future(process.wait())
+
+        try:
+            await asyncio.wait(
+                (connection, exited),
+                timeout=CONNECT_TIMEOUT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            server.close()
+            exited.cancel()
+
+        if not connection.done():
+            connection.cancel()
+
+            if process.returncode is None:
+                process.kill()
+
+            await process.wait()
+            raise ConnectionError("backend did not connect.")
+
+        return process, *connection.result()
+
+    async def _session(self, index: int) -> None:
+        random = Random(self._args.seed + index)
+        think_time = THINK_TIMES[self._args.think]
+
+        transcript_index = index % len(self._transcripts)
+        transcript = self._transcripts[transcript_index]
+
+        try:
+            process, reader, writer = await self._start_backend()
+        except OSError:
+            self._errors += 1
+            return
+
+        try:
+            layer = await connect(reader, writer)
+
+            for _ in range(self._args.repeat):
+                for i, code in enumerate(transcript):
+                    await asyncio.sleep(think_time(code, random, self._args.think_mean))
+
+                    request = code.encode("utf-8")
+
+                    start = time.perf_counter()
+                    await layer.send(request)
+                    response = await layer.recv()
+                    elapsed = time.perf_counter() - start
+
+                    key = transcript_index, i
+                    self._latencies.setdefault(key, []).append(elapsed)
+                    self._transferred += len(request) + len(response)
+        except (EOFError, OSError):
+            self._errors += 1
+        finally:
+            writer.close()
+            await process.wait()
+
+    async def run(self) -> dict[str, Any]:
+        start = time.perf_counter()
+
+        await asyncio.gather(
+            *(self._session(index) for index in range(self._args.sessions))
+        )
+
+        elapsed = time.perf_counter() - start
+
+        return self._report(elapsed)
+
+    def _report(self, elapsed: float) -> dict[str, Any]:
+        commands: list[dict[str, Any]] = []
+
+        for (transcript_index, i), latencies in sorted(self._latencies.items()):
+            latencies.sort()
+
+            command: dict[str, Any] = {
+                "transcript": transcript_index,
+                "index": i,
+                "code": self._transcripts[transcript_index][i],
+                "count": len(latencies),
+                "max": latencies[-1],
+            }
+            for percent in PERCENTILES:
+                command[f"p{percent}"] = percentile(latencies, percent)
+
+            commands.append(command)
+
+        count = sum(map(len, self._latencies.values()))
+
+        return {
+            "sessions": self._args.sessions,
+            "errors": self._errors,
+            "elapsed": elapsed,
+            "commands": count,
+            "commands_per_second": count / elapsed,
+            "bytes_per_second": self._transferred / elapsed,
+            "latencies": commands,
+        }
+
+
+def print_report(report: dict[str, Any]) -> None:
+    header = " ".join(f"{f'p{percent}':>9}" for percent in PERCENTILES)
+    print(f"{'command':<40} {'count':>6} {header} {'max':>9}  (ms)")
+
+    for command in report["latencies"]:
+        label = command["code"].splitlines()[0][:40]
+        values = " ".join(
+            f"{command[f'p{percent}'] * 1000:>9.2f}" for percent in PERCENTILES
+        )
+        maximum = command["max"] * 1000
+        print(f"{label:<40} {command['count']:>6} {values} {maximum:>9.2f}")
+
+    print(
+        f"{report['sessions']} sessions, {report['commands']} commands in "
+        f"{report['elapsed']:.2f} s: {report['commands_per_second']:.1f} commands/s, "
+        f"{report['bytes_per_second'] / 1024:.1f} KiB/s, {report['errors']} errors"
+    )
+
+
+def load(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(prog=f"{sys.argv[0]} load")
+    parser.add_argument("-n", "--sessions", type=int, default=8)
+    parser.add_argument("-r", "--repeat", type=int, default=1)
+    parser.add_argument("--think", choices=THINK_TIMES, default="exponential")
+    parser.add_argument("--think-mean", type=float, default=0.5)
+    parser.add_argument("--transcript", help="json list of commands, or of lists")
+    parser.add_argument("--backend", nargs="+", default=BACKEND_COMMAND)
+    parser.add_argument("--pool", help="hand sessions to a warm backend pool")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report there as json")
+    args = parser.parse_args(argv)
+
+    transcripts = [CODES]
+    if args.transcript:
+        with open(args.transcript) as fp:
+            loaded = json.load(fp)
+
+        transcripts = loaded if isinstance(loaded[0], list) else [loaded]
+        transcripts = [strip_codes(transcript) for transcript in transcripts]
+
+    report = asyncio.run(LoadGenerator(args, transcripts).run())
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+
 def main() -> None:
+    if sys.argv[1:2] == ["load"]:
+        load(sys.argv[2:])
+        return
+
     random = SystemRandom()
 
     with subprocess.Popen(SHELL_PATH, stdin=subprocess.PIPE) as process:
@@ -77,8 +343,7 @@ def main() -> None:
 
             process.stdin.write(code.encode("utf-8"))
 
-            word_count = len(re.findall(r"[\w\d]+", code))
-            wpm = WORD_PER_MINUTE + random.randint(-WAIT_ERROR, WAIT_ERROR)
+            word_count, wpm = typing_pace(code, random)
             wait_for = (word_count / wpm) * 60
 
             print(f"{word_count=} {wpm=} {wait_for=:.2f}")
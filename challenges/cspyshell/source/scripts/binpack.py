@@ -1,12 +1,57 @@
+import os
+import struct
 import sys
 import zlib
-from collections.abc import Buffer
-from typing import NoReturn, cast
+from bisect import bisect_right
+from collections.abc import Buffer, Iterable, Iterator
+from dataclasses import dataclass
+from itertools import repeat
+from typing import BinaryIO, NoReturn, cast
 
 Vector = tuple[
     int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int
 ]
 
+# a whole number of blocks, so that chunks can be crypted independently.
+CHUNK_SIZE = 1 << 20
+
+# plaintext bytes between two points where unpacking can start, also a whole
+# number of blocks.
+SEGMENT_SIZE = 1 << 16
+
+READ_SIZE = 1 << 14
+
+# deflate with a 32k window at the default level.
+_ZLIB_HEADER = b"\x78\x9c"
+
+_INDEX_HEADER = struct.Struct(">8sI")
+_INDEX_MAGIC = b"BINPKIDX"
+
+# plaintext offset, offset in the packed file, vector at that block.
+_INDEX_ENTRY = struct.Struct(">QQ16s")
+
+
+def _lanes(values: Iterable[int]) -> int:
+    return int.from_bytes(b"".join(value.to_bytes(2, "big") for value in values), "big")
+
+
+# the vector spread over 16-bit lanes of one int, so the per-element step
+# ((value + i * 7) >> 5) | (((value + i * 5) & 31) << 3) is a handful of big-int
+# operations rather than a python loop.
+_ADD_HIGH = _lanes(i * 7 for i in range(16))
+_ADD_LOW = _lanes(i * 5 for i in range(16))
+_MASK_HIGH = _lanes(repeat(0x7FF, 16))
+_MASK_LOW = _lanes(repeat(31, 16))
+
+_NIBBLES = bytes(value & 0xF for value in range(256))
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    offset: int
+    position: int
+    vector: Vector
+
 
 class Binpack:
     _vector: Vector
@@ -14,32 +59,37 @@ class Binpack:
     def __init__(self, iv: Vector) -> None:
         self._vector = iv
 
-    def _next(self) -> Vector:
-        values = list(
-            (((value + (i * 7)) >> 5) | (((value + (i * 5)) & 31) << 3))
-            for i, value in enumerate(self._vector)
-        )
+    def _keystream(self, blocks: int) -> bytearray:
+        stream = bytearray()
+        spread = bytearray(32)
+        vector = bytearray(self._vector)
 
-        for i, value in enumerate(self._vector):
-            source, target = i, value & 0xF
-            values[source], values[target] = values[target], values[source]
+        for _ in range(blocks):
+            stream += vector
 
-        self._vector = cast(Vector, tuple(values))
-        return self._vector
+            spread[1::2] = vector
+            lanes = int.from_bytes(spread, "big")
+            lanes = (((lanes + _ADD_HIGH) >> 5) & _MASK_HIGH) | (
+                ((lanes + _ADD_LOW) & _MASK_LOW) << 3
+            )
+            values = bytearray(lanes.to_bytes(32, "big")[1::2])
 
-    def crypt(self, buf: Buffer) -> bytes:
-        buf = memoryview(buf)
-        result = bytearray()
+            for source, target in enumerate(vector.translate(_NIBBLES)):
+                values[source], values[target] = values[target], values[source]
+
+            vector = values
 
-        while buf:
-            block, buf = buf[:16], buf[16:]
+        self._vector = cast(Vector, tuple(vector))
+        return stream
 
-            block = (ch ^ k for ch, k in zip(block, self._vector))
-            result.extend(block)
+    def crypt(self, buf: Buffer) -> bytes:
+        buf = memoryview(buf)
+        size = len(buf)
 
-            self._next()
+        stream = self._keystream((size + 15) // 16)
+        result = int.from_bytes(buf, "little") ^ int.from_bytes(stream[:size], "little")
 
-        return memoryview(result)
+        return memoryview(result.to_bytes(size, "little"))
 
     def pack(self, buf: Buffer) -> bytes:
         result = self.crypt(buf)
@@ -51,6 +101,127 @@ class Binpack:
         result = self.crypt(uncompressed)
         return result
 
+    def pack_stream(self, src: BinaryIO, dst: BinaryIO) -> None:
+        compressor = zlib.compressobj()
+
+        # buffered reads only come back short at the end of the input.
+        while chunk := src.read(CHUNK_SIZE):
+            dst.write(compressor.compress(self.crypt(chunk)))
+
+        dst.write(compressor.flush())
+
+    def unpack_stream(self, src: BinaryIO, dst: BinaryIO) -> None:
+        pending = bytearray()
+
+        for data in _inflate(src):
+            pending += data
+
+            size = len(pending) - len(pending) % 16
+            dst.write(self.crypt(pending[:size]))
+            del pending[:size]
+
+        dst.write(self.crypt(pending))
+
+    def pack_segments(
+        self, src: BinaryIO, dst: BinaryIO, segment_size: int = SEGMENT_SIZE
+    ) -> list[Checkpoint]:
+        if segment_size % 16:
+            raise ValueError("segment size must be a multiple of the block size.")
+
+        # still a single zlib stream, but the dictionary is reset after each
+        # segment, so raw inflate can start at any of the recorded positions.
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        checksum = zlib.adler32(b"")
+
+        checkpoints: list[Checkpoint] = []
+        offset = 0
+        position = dst.write(_ZLIB_HEADER)
+
+        while chunk := src.read(segment_size):
+            checkpoints.append(Checkpoint(offset, position, self._vector))
+
+            encrypted = self.crypt(chunk)
+            checksum = zlib.adler32(encrypted, checksum)
+
+            compressed = compressor.compress(encrypted)
+            compressed += compressor.flush(zlib.Z_FULL_FLUSH)
+
+            position += dst.write(compressed)
+            offset += len(chunk)
+
+        dst.write(compressor.flush())
+        dst.write(checksum.to_bytes(4, "big"))
+
+        return checkpoints
+
+
+def read_range(
+    src: BinaryIO, checkpoints: list[Checkpoint], start: int, end: int
+) -> bytes:
+    # an empty payload is packed without any checkpoint.
+    if not checkpoints:
+        return b""
+
+    index = bisect_right(checkpoints, start, key=lambda checkpoint: checkpoint.offset)
+    checkpoint = checkpoints[max(index - 1, 0)]
+
+    src.seek(checkpoint.position)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    wanted = end - checkpoint.offset
+    data = bytearray()
+
+    while len(data) < wanted and not decompressor.eof:
+        chunk = decompressor.unconsumed_tail or src.read(READ_SIZE)
+        if not chunk:
+            break
+
+        data += decompressor.decompress(chunk, wanted - len(data))
+
+    packer = Binpack(checkpoint.vector)
+    result = packer.crypt(data)
+
+    return result[start - checkpoint.offset :]
+
+
+def write_index(path: str, checkpoints: list[Checkpoint]) -> None:
+    with open(path, "wb") as fp:
+        fp.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(checkpoints)))
+
+        for checkpoint in checkpoints:
+            vector = bytes(checkpoint.vector)
+            fp.write(_INDEX_ENTRY.pack(checkpoint.offset, checkpoint.position, vector))
+
+
+def read_index(path: str) -> list[Checkpoint]:
+    with open(path, "rb") as fp:
+        magic, count = _INDEX_HEADER.unpack(fp.read(_INDEX_HEADER.size))
+        if magic != _INDEX_MAGIC:
+            raise ValueError("not a binpack index.")
+
+        entries = fp.read(_INDEX_ENTRY.size * count)
+
+    return [
+        Checkpoint(offset, position, cast(Vector, tuple(vector)))
+        for offset, position, vector in _INDEX_ENTRY.iter_unpack(entries)
+    ]
+
+
+def _inflate(src: BinaryIO) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj()
+
+    while chunk := src.read(CHUNK_SIZE):
+        # bounded output even for highly compressed input.
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+
+    yield decompressor.flush()
+
+    # like zlib.decompress(), a stream cut short is an error, not partial output.
+    if not decompressor.eof:
+        raise zlib.error("incomplete or truncated stream.")
+
 
 def pack(buf: Buffer, iv: Vector) -> bytes:
     packer = Binpack(iv)
@@ -68,26 +239,47 @@ def report(msg: str) -> NoReturn:
 
 
 def main() -> None:
-    if len(sys.argv) != 5:
-        report(f"usage: {sys.argv[0]} pack/unpack [iv] [input] [output]")
+    if len(sys.argv) not in (5, 6):
+        report(
+            f"usage: {sys.argv[0]} pack/pack-seekable/unpack [iv] [input] [output] "
+            "[start:end]"
+        )
 
-    cmd, iv, inp, out = sys.argv[1:]
+    cmd, iv, inp, out, *bounds = sys.argv[1:]
+
+    if cmd not in ("pack", "pack-seekable", "unpack"):
+        report("invalid command.")
+
+    # a byte range can only be unpacked with the index of a seekable pack.
+    if bounds and cmd != "unpack":
+        report("a range is only supported when unpacking.")
 
     iv = tuple(map(int, iv.split(",")))
     if len(iv) != 16 or not all(0 <= val <= 255 for val in iv):
         report("invalid iv.")
 
-    with open(inp, "rb") as fp:
-        data = fp.read()
+    packer = Binpack(cast(Vector, iv))
+
+    # the output replaces the target only once complete, which may be the input.
+    tmp = f"{out}.tmp"
 
-    match cmd:
-        case "pack":
-            data = pack(data, iv)
-        case "unpack":
-            data = unpack(data, iv)
+    try:
+        with open(inp, "rb") as src, open(tmp, "wb") as dst:
+            match cmd, bounds:
+                case "pack", _:
+                    packer.pack_stream(src, dst)
+                case "pack-seekable", _:
+                    write_index(f"{out}.idx", packer.pack_segments(src, dst))
+                case "unpack", []:
+                    packer.unpack_stream(src, dst)
+                case "unpack", [bound]:
+                    start, end = map(int, bound.split(":"))
+                    dst.write(read_range(src, read_index(f"{inp}.idx"), start, end))
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
-    with open(out, "wb") as fp:
-        fp.write(data)
+    os.replace(tmp, out)
 
 
 if __name__ == "__main__":
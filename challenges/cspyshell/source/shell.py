@@ -1,15 +1,88 @@
+import errno
+import mmap
 import os
+import struct
 import sys
 import zipfile
 
+CHUNK_SIZE = 1 << 20
+
+# signature, versions, flags, method, time, date, crc, sizes, name/extra length.
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_SIGNATURE = b"PK\x03\x04"
+
+
+def write_all(fd: int, data: memoryview) -> None:
+    # writes to a pipe may be short.
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def data_offset(archive: mmap.mmap, info: zipfile.ZipInfo) -> int:
+    if info.header_offset + _LOCAL_HEADER.size > len(archive):
+        raise zipfile.BadZipFile("archive ends before the local header does.")
+
+    header = _LOCAL_HEADER.unpack_from(archive, info.header_offset)
+    if header[0] != _LOCAL_SIGNATURE:
+        raise zipfile.BadZipFile("bad magic number for the local header.")
+
+    name_length, extra_length = header[-2:]
+
+    return info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+
+
+def _check_copied(copied: int) -> int:
+    # nothing copied means the file ended early, retrying would spin forever.
+    if not copied:
+        raise zipfile.BadZipFile("archive ends before the member does.")
+
+    return copied
+
+
+def copy_range(archive: mmap.mmap, src: int, dst: int, offset: int, size: int) -> None:
+    end = offset + size
+
+    if end > len(archive):
+        raise zipfile.BadZipFile("archive ends before the member does.")
+
+    try:
+        while offset < end:
+            offset += _check_copied(os.sendfile(dst, src, offset, end - offset))
+        return
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOSYS):
+            raise
+
+    if hasattr(os, "splice"):
+        try:
+            while offset < end:
+                copied = os.splice(src, dst, end - offset, offset_src=offset)
+                offset += _check_copied(copied)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+
+    # still no copy into a python object, the pages are written straight out.
+    write_all(dst, memoryview(archive)[offset:end])
+
 
 def main() -> None:
     fd = int(sys.argv[1])
 
-    with zipfile.ZipFile(__loader__.archive, "r") as zip:
-        dll = zip.read("core.dll")
+    with open(__loader__.archive, "rb") as fp, zipfile.ZipFile(fp, "r") as zip:
+        info = zip.getinfo("core.dll")
+
+        if info.compress_type != zipfile.ZIP_STORED:
+            with zip.open(info) as member:
+                while chunk := member.read(CHUNK_SIZE):
+                    write_all(fd, memoryview(chunk))
+            return
 
-    os.write(fd, dll)
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as archive:
+            offset = data_offset(archive, info)
+            copy_range(archive, fp.fileno(), fd, offset, info.file_size)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,19 @@
+import contextlib
+from typing import AsyncIterator
+
 from slowugi import SlowUGI
 from starlette.applications import Starlette
 from starlette.staticfiles import StaticFiles
 
-app = Starlette()
-app.mount("/ugi-bin", SlowUGI("ugi-bin"))
+ugi = SlowUGI("ugi-bin")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    yield
+    await ugi.close()
+
+
+app = Starlette(lifespan=lifespan)
+app.mount("/ugi-bin", ugi)
 app.mount("/", StaticFiles(directory="static", html=True))
@@ -1,17 +1,52 @@
 import asyncio
 import contextlib
+import json
 import os
 import posixpath
+import struct
 import subprocess
+import sys
+import traceback
+from collections.abc import Callable, Iterable
 from dataclasses import dataclass
+from enum import IntEnum
+from functools import lru_cache
 from os import PathLike
 from pathlib import Path
 from typing import AsyncGenerator
 
 from starlette.datastructures import Headers, MutableHeaders, QueryParams
-from starlette.requests import Request
+from starlette.requests import ClientDisconnect, Request
 from starlette.responses import PlainTextResponse, StreamingResponse
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# scripts carrying this line near the top are served by persistent workers.
+WORKER_MARKER = b"# slowugi: persistent"
+WORKER_MARKER_SEARCH_SIZE = 1024
+
+WORKER_POOL_SIZE = 4
+
+# set for scripts started as persistent workers.
+WORKER_ENV = "UGI_WORKER"
+
+# how far a script's output may run ahead of the client.
+STREAM_LIMIT = 1 << 20
+
+HEADERS_READ_SIZE = 1 << 16
+
+BODY_CHUNK_MIN_SIZE = 1 << 14
+BODY_CHUNK_MAX_SIZE = 1 << 20
+
+# frame type and payload size.
+_FRAME_HEADER = struct.Struct(">BI")
+
+
+class FrameType(IntEnum):
+    PARAMS = 0
+    STDIN = 1
+    STDOUT = 2
+    END = 3
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -26,11 +61,146 @@ class _EnvsBuildResult:
     body_consumed: bool
 
 
+def _find_headers_end(buffer: bytes | bytearray, start: int = 0) -> int | None:
+    while (end := buffer.find(b"\n", start)) != -1:
+        if not buffer[start:end].rstrip():
+            return end + 1
+
+        start = end + 1
+
+    return None
+
+
+def _parse_headers(block: bytes | bytearray) -> _UGIResponseHeaders:
+    headers = MutableHeaders()
+
+    for line in block.decode("utf-8").splitlines():
+        line = line.rstrip()
+
+        if not line:
+            break
+
+        name, _, value = line.partition(":")
+        value = value.lstrip()
+
+        headers[name] = value
+
+    status = int(headers.get("Status", "200"))
+
+    with contextlib.suppress(KeyError):
+        del headers["Status"]
+
+    return _UGIResponseHeaders(status=status, other=headers)
+
+
+@lru_cache
+def _is_persistent(path: Path, mtime: int) -> bool:
+    with open(path, "rb") as fp:
+        head = fp.read(WORKER_MARKER_SEARCH_SIZE)
+
+    return WORKER_MARKER in head.splitlines()
+
+
+class _Worker:
+    process: asyncio.subprocess.Process
+
+    def __init__(self, process: asyncio.subprocess.Process) -> None:
+        self.process = process
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def send(self, frame_type: FrameType, payload: bytes = b"") -> None:
+        assert self.process.stdin is not None, "stdin should not be None."
+
+        self.process.stdin.write(_FRAME_HEADER.pack(frame_type, len(payload)))
+        self.process.stdin.write(payload)
+        await self.process.stdin.drain()
+
+    async def recv(self) -> tuple[FrameType, bytes]:
+        assert self.process.stdout is not None, "stdout should not be None."
+
+        header = await self.process.stdout.readexactly(_FRAME_HEADER.size)
+        frame_type, size = _FRAME_HEADER.unpack(header)
+
+        return FrameType(frame_type), await self.process.stdout.readexactly(size)
+
+    def kill(self) -> None:
+        if self.alive:
+            self.process.kill()
+
+
+class _WorkerPool:
+    path: Path
+    _idle: list[_Worker]
+    _slots: asyncio.Semaphore
+
+    def __init__(self, path: Path, size: int) -> None:
+        self.path = path
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _spawn(self) -> _Worker:
+        envs = os.environ.copy()
+        envs[WORKER_ENV] = "1"
+
+        process = await asyncio.create_subprocess_exec(
+            self.path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=envs,
+        )
+
+        return _Worker(process)
+
+    async def acquire(self) -> _Worker:
+        await self._slots.acquire()
+
+        while self._idle:
+            worker = self._idle.pop()
+
+            if worker.alive:
+                return worker
+
+        try:
+            return await self._spawn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, worker: _Worker, reusable: bool) -> None:
+        # a worker which did not finish its request cleanly is never reused.
+        if reusable and worker.alive:
+            self._idle.append(worker)
+        else:
+            worker.kill()
+
+        self._slots.release()
+
+    async def close(self) -> None:
+        for worker in self._idle:
+            worker.kill()
+            await worker.process.wait()
+
+        self._idle.clear()
+
+
 class SlowUGI:
     directory: Path
+    worker_pool_size: int
+    _pools: dict[Path, _WorkerPool]
 
-    def __init__(self, directory: PathLike[str] | str) -> None:
+    def __init__(
+        self, directory: PathLike[str] | str, worker_pool_size: int = WORKER_POOL_SIZE
+    ) -> None:
         self.directory = Path(directory)
+        self.worker_pool_size = worker_pool_size
+        self._pools = {}
+
+    async def close(self) -> None:
+        for pool in self._pools.values():
+            await pool.close()
 
     @staticmethod
     def _safe_resolve_path(path: PathLike[str] | str) -> str:
@@ -107,61 +277,164 @@ class SlowUGI:
         built_envs = await self._build_envs(request)
         envs.update(built_envs.envs)
 
-        process = subprocess.Popen(
+        process = await asyncio.create_subprocess_exec(
             path,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            shell=False,
             env=envs,
+            limit=STREAM_LIMIT,
         )
 
-        async def read_headers() -> _UGIResponseHeaders:
-            assert process.stdout is not None, "stdout should not be None."
+        assert process.stdin is not None, "stdin should not be None."
+        assert process.stdout is not None, "stdout should not be None."
+
+        stdin, stdout = process.stdin, process.stdout
 
-            headers = MutableHeaders()
+        async def read_headers() -> tuple[_UGIResponseHeaders, bytes]:
+            # the headers usually arrive in one read, the body may follow them.
+            buffer = bytearray()
+            scanned = 0
 
-            while True:
-                line = await asyncio.to_thread(process.stdout.readline)
-                line = line.decode("utf-8").rstrip()
+            while (end := _find_headers_end(buffer, scanned)) is None:
+                data = await stdout.read(HEADERS_READ_SIZE)
 
-                if not line:
+                if not data:
+                    end = len(buffer)
                     break
 
-                name, _, value = line.partition(":")
-                value = value.lstrip()
+                # only complete lines are skipped when scanning again.
+                scanned = buffer.rfind(b"\n") + 1
+                buffer += data
 
-                headers[name] = value
+            return _parse_headers(buffer[:end]), bytes(buffer[end:])
 
-            status = int(headers.get("Status", "200"))
+        async def feed() -> None:
+            # like communicate(), a script may exit without reading its input.
+            with contextlib.suppress(
+                BrokenPipeError, ConnectionResetError, ClientDisconnect
+            ):
+                if not built_envs.body_consumed:
+                    # the next chunk is only received once the script took this one.
+                    async for data in request.stream():
+                        stdin.write(data)
+                        await stdin.drain()
+
+            stdin.close()
+
+        async def finish() -> None:
+            # the client may be gone before the script is done.
+            if process.returncode is None and not stdout.at_eof():
+                process.kill()
+
+            # a script may still be reading its input after closing its output.
+            await process.wait()
+
+            feeder.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await feeder
+
+        async def stream(body: bytes) -> AsyncGenerator[bytes, None]:
+            size = BODY_CHUNK_MIN_SIZE
+
+            try:
+                if body:
+                    yield body
+
+                while buffer := await stdout.read(size):
+                    yield buffer
+
+                    # reads which fill the chunk mean the script is ahead of us.
+                    if len(buffer) == size:
+                        size = min(size * 2, BODY_CHUNK_MAX_SIZE)
+            finally:
+                await finish()
+
+        # input is fed while output is read, so a script answering before it has
+        # read everything can neither stall nor delay the response.
+        feeder = asyncio.create_task(feed())
+
+        try:
+            headers, body = await read_headers()
+        except BaseException:
+            await finish()
+            raise
+
+        response = StreamingResponse(stream(body), headers.status, headers.other)
+
+        async def respond(scope: Scope, receive: Receive, send: Send) -> None:
+            async def receive_after_body() -> Message:
+                # the response only listens for a disconnect, which must not
+                # swallow body chunks still being fed.
+                await asyncio.wait((feeder,))
+                return await receive()
+
+            await response(scope, receive_after_body, send)
+
+        return respond
+
+    async def _forward_to_worker(self, path: Path, request: Request) -> ASGIApp:
+        built_envs = await self._build_envs(request)
 
-            with contextlib.suppress(KeyError):
-                del headers["Status"]
+        pool = self._pools.get(path)
+        if pool is None:
+            pool = self._pools[path] = _WorkerPool(path, self.worker_pool_size)
 
-            return _UGIResponseHeaders(status=status, other=headers)
+        worker = await pool.acquire()
 
-        async def feed() -> None:
-            assert process.stdin is not None, "stdin should not be None."
+        buffer = bytearray()
+        finished = False
 
-            async for data in request.stream():
-                await asyncio.to_thread(process.stdin.write, data)
+        try:
+            # the worker already has our environment, only the request is sent.
+            await worker.send(FrameType.PARAMS, json.dumps(built_envs.envs).encode())
 
-            process.stdin.close()
+            if not built_envs.body_consumed:
+                # like a script, the worker gets whatever arrived before that.
+                with contextlib.suppress(ClientDisconnect):
+                    async for data in request.stream():
+                        if data:
+                            await worker.send(FrameType.STDIN, data)
 
-        async def stream() -> AsyncGenerator[bytes, None]:
-            assert process.stdout is not None, "stdout should not be None."
+            await worker.send(FrameType.STDIN)
 
-            while True:
-                buffer = await asyncio.to_thread(process.stdout.read, 1024)
+            while (end := _find_headers_end(buffer)) is None:
+                frame_type, payload = await worker.recv()
 
-                if not buffer:
+                if frame_type is FrameType.END:
+                    end = len(buffer)
+                    finished = True
                     break
 
-                yield buffer
+                buffer += payload
+        except (OSError, asyncio.IncompleteReadError):
+            pool.release(worker, False)
+            return PlainTextResponse("Bad Gateway", 502)
+        except BaseException:
+            pool.release(worker, False)
+            raise
+
+        headers = _parse_headers(buffer[:end])
+        body = bytes(buffer[end:])
+
+        async def stream() -> AsyncGenerator[bytes, None]:
+            reusable = finished
+
+            try:
+                if body:
+                    yield body
 
-        if not built_envs.body_consumed:
-            await feed()
+                while not reusable:
+                    frame_type, payload = await worker.recv()
+
+                    if frame_type is FrameType.END:
+                        reusable = True
+                    else:
+                        yield payload
+            except asyncio.IncompleteReadError:
+                pass
+            finally:
+                pool.release(worker, reusable)
 
-        headers = await read_headers()
         return StreamingResponse(stream(), headers.status, headers.other)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
@@ -174,8 +447,63 @@ class SlowUGI:
                 response = PlainTextResponse("Forbidden", 403)
             else:
                 request = Request(scope, receive, send)
-                response = await self._forward_to_ugi(path, request)
+
+                if _is_persistent(path, path.stat().st_mtime_ns):
+                    response = await self._forward_to_worker(path, request)
+                else:
+                    response = await self._forward_to_ugi(path, request)
         else:
             response = PlainTextResponse("Not Found", 404)
 
         await response(scope, receive, send)
+
+
+def run_worker(handler: Callable[[dict[str, str], bytes], Iterable[bytes]]) -> None:
+    stdin = sys.stdin.buffer
+
+    # frames get a private copy of stdout, while fd 1 and sys.stdout point at
+    # stderr, so that output of the handler can not corrupt them.
+    sys.stdout.flush()
+    stdout = os.fdopen(os.dup(1), "wb")
+    original_stdout = sys.stdout
+
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def recv() -> tuple[FrameType, bytes] | None:
+        header = stdin.read(_FRAME_HEADER.size)
+
+        if len(header) < _FRAME_HEADER.size:
+            return None
+
+        frame_type, size = _FRAME_HEADER.unpack(header)
+        return FrameType(frame_type), stdin.read(size)
+
+    def send(frame_type: FrameType, payload: bytes = b"") -> None:
+        stdout.write(_FRAME_HEADER.pack(frame_type, len(payload)))
+        stdout.write(payload)
+
+    try:
+        while (frame := recv()) is not None:
+            frame_type, payload = frame
+            assert frame_type is FrameType.PARAMS, "a request should start with params."
+
+            envs = os.environ | json.loads(payload)
+            body = bytearray()
+
+            while (frame := recv()) is not None and frame[1]:
+                body += frame[1]
+
+            try:
+                for data in handler(envs, bytes(body)):
+                    if data:
+                        send(FrameType.STDOUT, data)
+            except Exception:
+                traceback.print_exc()
+
+            send(FrameType.END)
+            stdout.flush()
+    finally:
+        os.dup2(stdout.fileno(), 1)
+        sys.stdout = original_stdout
+        stdout.close()